@@ -5,6 +5,7 @@
 # -----------------------------------------------------------------------------
 
 import os
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -26,12 +27,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+  "wrpt.metrics.MetricsMiddleware",
   "django.middleware.common.CommonMiddleware",
   "django.contrib.sessions.middleware.SessionMiddleware",
   "django.middleware.csrf.CsrfViewMiddleware",
   "django.middleware.clickjacking.XFrameOptionsMiddleware",
   "django.contrib.auth.middleware.AuthenticationMiddleware",
   "django.contrib.messages.middleware.MessageMiddleware",
+  "wrpt.profiling.ProfilingMiddleware",
   "whitenoise.middleware.WhiteNoiseMiddleware"
 ]
 
@@ -47,6 +50,36 @@ if os.environ.get("WRPT_USE_SQLITE3", "0") == "1":
     }
   }
 
+# The cache must be shared by all server processes so that
+# invalidations made by one process are seen by the others, hence not
+# the default per-process memory cache.  In production, where server
+# processes run on multiple Heroku dynos that share nothing but the
+# database, the cache is kept in the database (in a table created by
+# migration 0009).  In development (SQLite), where all processes run
+# on one machine, a file-based cache suffices.
+if os.environ.get("WRPT_USE_SQLITE3", "0") == "1":
+  CACHES = {
+    "default": {
+      "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+      "LOCATION": os.environ.get("WRPT_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "wrpt-cache")),
+      "OPTIONS": { "MAX_ENTRIES": 10000 }
+    }
+  }
+else:
+  CACHES = {
+    "default": {
+      "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+      "LOCATION": "wrpt_cache",
+      "OPTIONS": { "MAX_ENTRIES": 10000 }
+    }
+  }
+
+# The engine used to compute program statistics, "python", "numpy" or
+# "sql" (PostgreSQL only; see wrpt/stats.py).
+WRPT_PROGRAM_STATS_ENGINE = os.environ.get("WRPT_PROGRAM_STATS_ENGINE",
+  "python")
+
 TIME_ZONE = "America/Los_Angeles"
 USE_I18N = True
 USE_L10N = True
@@ -57,8 +90,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 STATICFILES_DIRS = [os.path.join(BASE_DIR, "coast_wrpt", "static")]
 WHITENOISE_ROOT = os.path.join(BASE_DIR, "coast_wrpt", "static", "root")
 
+# The directory through which server processes share performance
+# metrics (see wrpt/metrics.py).
+WRPT_METRICS_DIR = os.environ.get("WRPT_METRICS_DIR",
+  os.path.join(tempfile.gettempdir(), "wrpt-metrics"))
+
+# The directory in which profiling reports are saved (see
+# wrpt/profiling.py).
+WRPT_PROFILE_DIR = os.environ.get("WRPT_PROFILE_DIR",
+  os.path.join(tempfile.gettempdir(), "wrpt-profiles"))
+
 TEMPLATES = [
-  { "BACKEND": "django.template.backends.django.DjangoTemplates",
+  { "BACKEND": "wrpt.metrics.TimedTemplates",
     "DIRS": [os.path.join(BASE_DIR, "coast_wrpt", "templates")],
     "APP_DIRS": True,
     "OPTIONS": {
@@ -0,0 +1,7 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+default_app_config = "wrpt.apps.WrptConfig"
@@ -7,11 +7,16 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User, Group
+from django.core.paginator import Paginator
 from django.core.validators import ValidationError
+from django.db import connection
 from django.forms import ModelForm
+from django.utils.functional import cached_property
 
-from wrpt.models import Classroom, Count, EventDate, Program, Schedule,\
-  School, WrptUser
+from wrpt import audit, caching, search
+from wrpt.models import Classroom, Count, CountAudit, EventDate, Program,\
+  Schedule, School, WrptUser
+from wrpt.views import log, logBatch
 
 class WrptUserAdmin (UserAdmin):
   # Customize the fields displayed in list view (principally, add
@@ -93,17 +98,39 @@ class ProgramAdmin (admin.ModelAdmin):
   inlines = [ClassroomInline]
 
 class ProgramFilter (admin.SimpleListFilter):
-  # The sole purpose of this custom filter, over a simple "program"
-  # filter, is to control the listing order.
+  # The purposes of this custom filter, over a simple "program"
+  # filter, are to control the listing order and to cache the choices.
   title = "program"
   parameter_name = "program"
   def lookups (self, request, model_admin):
-    return [(p.id, str(p)) for p in\
-      Program.objects.all().order_by("-schoolYear", "school__name")]
+    choices = caching.getProgramChoices()
+    if choices == None:
+      choices = [(p.id, str(p)) for p in Program.objects.all()\
+        .select_related("school").order_by("-schoolYear", "school__name")]
+      caching.setProgramChoices(choices)
+    return choices
   def queryset (self, request, queryset):
     if self.value() != None: queryset = queryset.filter(program=self.value())
     return queryset
 
+estimateThreshold = 100000 # rows
+
+class EstimatedCountPaginator (Paginator):
+  # Counting the rows of a large table is slow on PostgreSQL, so for
+  # unfiltered listings of large tables the planner's estimate of the
+  # number of rows is used instead.  (An overestimate merely results
+  # in empty trailing pages.)
+  @cached_property
+  def count (self):
+    q = self.object_list
+    if connection.vendor == "postgresql" and not q.query.where:
+      with connection.cursor() as c:
+        c.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+          [q.model._meta.db_table])
+        row = c.fetchone()
+      if row != None and row[0] >= estimateThreshold: return int(row[0])
+    return super().count
+
 class CountForm (ModelForm):
   # For some reason the default Count form doesn't check that a
   # modified count continues to satisfy the uniqueness constraint.
@@ -136,8 +163,13 @@ class CountAdmin (admin.ModelAdmin):
   )
   ordering = ["-program__schoolYear", "program__school__name",
     "-eventDate__date", "classroom__name"]
-  list_display = ["__str__", "comments"]
+  # Rows are fetched with their related objects, which are displayed
+  # as separate columns.
+  list_display = ["program", "date", "classroom", "value", "comments"]
+  list_select_related = ["program__school", "eventDate", "classroom"]
   list_filter = (ProgramFilter,)
+  paginator = EstimatedCountPaginator
+  show_full_result_count = False
   search_fields = ["program__schoolYear", "program__school__name",
     "classroom__name", "comments"]
   form = CountForm
@@ -147,6 +179,14 @@ class CountAdmin (admin.ModelAdmin):
   # just disable creation altogether.
   def has_add_permission (self, request):
     return False
+  def get_search_results (self, request, queryset, search_term):
+    # Searches use the full-text index (see wrpt.search).
+    if search_term.strip() == "": return queryset, False
+    return search.filterCounts(queryset, search_term), False
+  def date (self, obj):
+    return obj.eventDate.date
+  date.admin_order_field = "eventDate__date"
+  date.short_description = "Event date"
   # The next two functions limit the event date and classroom menu
   # choices according to the count's (fixed) program.
   def get_form (self, request, obj=None, **kwargs):
@@ -160,6 +200,46 @@ class CountAdmin (admin.ModelAdmin):
       kwargs["queryset"] = Classroom.objects.filter(
         program=self.the_count.program).order_by("name")
     return super().formfield_for_foreignkey(db_field, request, **kwargs)
+  # Changes made in the admin are logged and audited like those made
+  # in the views.
+  def save_model (self, request, obj, form, change):
+    before = Count.objects.get(pk=obj.pk)
+    super().save_model(request, obj, form, change)
+    log(request, "update", before, obj)
+  def delete_model (self, request, obj):
+    before = audit.snapshot(obj)
+    super().delete_model(request, obj)
+    log(request, "delete", before)
+  def delete_queryset (self, request, queryset):
+    deleted = list(queryset)
+    super().delete_queryset(request, queryset)
+    logBatch(request, [("delete", c, None) for c in deleted])
+
+class CountAuditAdmin (admin.ModelAdmin):
+  # Audit records are read-only.
+  date_hierarchy = "time"
+  list_display = ["time", "username", "operation", "program", "eventDate",
+    "classroom", "valueBefore", "valueAfter"]
+  list_filter = ("operation", ProgramFilter, "username")
+  list_select_related = ["program__school", "eventDate", "classroom"]
+  paginator = EstimatedCountPaginator
+  show_full_result_count = False
+  search_fields = ["username", "remoteAddress", "commentsBefore",
+    "commentsAfter"]
+  fieldsets = (
+    (None, { "fields": ("time", "username", "remoteAddress", "operation",
+      "count", "program", "eventDate", "classroom") }),
+    ("Before", { "fields": ["%sBefore" % f for f in\
+      CountAudit.auditedFields] }),
+    ("After", { "fields": ["%sAfter" % f for f in\
+      CountAudit.auditedFields] })
+  )
+  def has_add_permission (self, request):
+    return False
+  def has_change_permission (self, request, obj=None):
+    return False
+  def has_delete_permission (self, request, obj=None):
+    return False
 
 admin.site.unregister(User)
 admin.site.unregister(Group)
@@ -169,3 +249,4 @@ admin.site.register(School, SchoolAdmin)
 admin.site.register(Schedule, ScheduleAdmin)
 admin.site.register(Program, ProgramAdmin)
 admin.site.register(Count, CountAdmin)
+admin.site.register(CountAudit, CountAuditAdmin)
@@ -0,0 +1,114 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Statistics computed by database aggregation, for views spanning many
+# programs.  The queries are evaluated over the grid of classrooms and
+# the event dates (not in the future) of their programs' schedules, so
+# that, as in wrpt.stats.computeClassroomData, a classroom having no
+# count for an event date is penalized by being given zero
+# participation relative to its most recently observed enrollment (or
+# its nominal enrollment, if there is none).  Counts on dates not in
+# a program's schedule (as may remain after a schedule change) are
+# disregarded throughout.  Only sums are computed
+# in the database; percentages are computed by wrpt.stats.percentage
+# so that rounding is identical.
+
+from django.db import connection
+
+from wrpt.models import Classroom, Count, CumulativeStats, EventDate,\
+  Program
+from wrpt.stats import percentage
+
+def table (model):
+  return connection.ops.quote_name(model._meta.db_table)
+
+def column (model, field):
+  return connection.ops.quote_name(model._meta.get_field(field).column)
+
+def gridSql (numPrograms):
+  # Returns SQL for the grid over the classrooms of `numPrograms`
+  # programs.  The parameters are the current date followed by the
+  # program IDs.  Columns: classroomId, eventDateId, date, and
+  # present, active and inactive (the classroom's number of students
+  # present, and active and inactive counts, on the date).
+  q = { "classroom": table(Classroom), "program": table(Program),
+    "eventdate": table(EventDate), "count": table(Count),
+    "cl_program": column(Classroom, "program"),
+    "cl_enrollment": column(Classroom, "enrollment"),
+    "p_schedule": column(Program, "schedule"),
+    "e_schedule": column(EventDate, "schedule"),
+    "e_date": column(EventDate, "date"),
+    "c_classroom": column(Count, "classroom"),
+    "c_eventDate": column(Count, "eventDate"),
+    "c_enrollment": column(Count, "enrollment"),
+    "c_value": column(Count, "value"),
+    "c_activeValue": column(Count, "activeValue"),
+    "c_inactiveValue": column(Count, "inactiveValue"),
+    "c_absentees": column(Count, "absentees"),
+    "programs": ", ".join(["%s"]*numPrograms) }
+  return ("""
+    SELECT cl.id AS classroomId, e.id AS eventDateId, e.%(e_date)s AS date,
+      CASE WHEN c.id IS NOT NULL
+        THEN c.%(c_enrollment)s - c.%(c_absentees)s
+        ELSE COALESCE((SELECT c2.%(c_enrollment)s
+          FROM %(count)s c2
+          JOIN %(eventdate)s e2 ON e2.id = c2.%(c_eventDate)s
+          WHERE c2.%(c_classroom)s = cl.id
+            AND e2.%(e_schedule)s = p.%(p_schedule)s
+            AND e2.%(e_date)s < e.%(e_date)s
+          ORDER BY e2.%(e_date)s DESC LIMIT 1), cl.%(cl_enrollment)s)
+      END AS present,
+      COALESCE(c.%(c_activeValue)s, c.%(c_value)s, 0) AS active,
+      COALESCE(c.%(c_inactiveValue)s, 0) AS inactive
+    FROM %(classroom)s cl
+    JOIN %(program)s p ON p.id = cl.%(cl_program)s
+    JOIN %(eventdate)s e ON e.%(e_schedule)s = p.%(p_schedule)s
+      AND e.%(e_date)s <= %%s
+    LEFT JOIN %(count)s c ON c.%(c_classroom)s = cl.id
+      AND c.%(c_eventDate)s = e.id
+    WHERE cl.%(cl_program)s IN (%(programs)s)""" % q)
+
+def cumulativeSums (programIds, today):
+  # Returns { classroom ID: (presentSum, activeSum, inactiveSum) }
+  # through `today` for the classrooms of the given programs.
+  # Classrooms whose programs have no event dates not after `today`
+  # are omitted.
+  programIds = list(programIds)
+  if len(programIds) == 0: return {}
+  with connection.cursor() as cursor:
+    cursor.execute("""
+      SELECT g.classroomId, SUM(g.present), SUM(g.active), SUM(g.inactive)
+      FROM (%s) g
+      GROUP BY g.classroomId""" % gridSql(len(programIds)),
+      [today] + programIds)
+    return dict((r[0], tuple(int(v) for v in r[1:])) for r in cursor)
+
+def windowCumulativeStats (programId, today):
+  # Returns { classroom ID: { event date ID: CumulativeStats } } for
+  # the program's classrooms, in the form returned by
+  # wrpt.cumulative.loadCumulativeStats, but computed by a single query
+  # using window functions rather than read from the table.  The
+  # returned objects are not saved.
+  with connection.cursor() as cursor:
+    cursor.execute("""
+      SELECT g.classroomId, g.eventDateId,
+        SUM(g.present) OVER w, SUM(g.active) OVER w, SUM(g.inactive) OVER w
+      FROM (%s) g
+      WINDOW w AS (PARTITION BY g.classroomId ORDER BY g.date)""" %\
+      gridSql(1), [today, programId])
+    result = dict((c, {}) for c in Classroom.objects.filter(
+      program=programId).values_list("pk", flat=True))
+    for classroomId, eventDateId, presentSum, activeSum, inactiveSum\
+      in cursor:
+      presentSum, activeSum, inactiveSum =\
+        int(presentSum), int(activeSum), int(inactiveSum)
+      result[classroomId][eventDateId] = CumulativeStats(
+        classroom_id=classroomId, eventDate_id=eventDateId,
+        presentSum=presentSum, activeSum=activeSum, inactiveSum=inactiveSum,
+        combinedCumPct=percentage(activeSum+inactiveSum, presentSum),
+        activeCumPct=percentage(activeSum, presentSum),
+        inactiveCumPct=percentage(inactiveSum, presentSum))
+  return result
@@ -0,0 +1,13 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+from django.apps import AppConfig
+
+class WrptConfig (AppConfig):
+  name = "wrpt"
+  def ready (self):
+    # Importing the module connects the signal receivers.
+    import wrpt.signals
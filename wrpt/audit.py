@@ -0,0 +1,121 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# The count audit log.  Count operations are recorded both as log
+# messages (on the "wrpt" logger, as before) and as CountAudit
+# records in the database.  Neither is written on the request thread:
+# records are queued and written by a background thread, in batches
+# of up to `batchSize` records collected over at most `flushInterval`
+# seconds.  The queue is drained when the process exits.
+
+import atexit
+import copy
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from wrpt.models import CountAudit
+
+batchSize = 100
+flushInterval = 1.0 # seconds
+
+_queue = queue.Queue()
+_thread = None
+_lock = threading.Lock()
+
+def countAudit (username, remoteAddress, operation, count1, count2=None):
+  # Returns an (unsaved) CountAudit for an operation on a count by the
+  # given user from the given address (which may be None).  For
+  # "create" and "delete" operations `count1` is the count created or
+  # deleted; for "update" operations `count1` and `count2` are the
+  # count before and after.
+  before = count1 if operation != "create" else None
+  after = count2 if operation == "update" else\
+    (count1 if operation == "create" else None)
+  c = after if after != None else before
+  a = CountAudit(time=timezone.now(), username=username,
+    remoteAddress=remoteAddress or "", operation=operation,
+    count=c.id, program_id=c.program_id, eventDate_id=c.eventDate_id,
+    classroom_id=c.classroom_id)
+  for f in CountAudit.auditedFields:
+    setattr(a, f+"Before", getattr(before, f) if before != None else None)
+    setattr(a, f+"After", getattr(after, f) if after != None else None)
+  return a
+
+def operationFormat (operation, count1, count2=None):
+  # Returns a count operation (arguments as for countAudit) as
+  # formatted in log messages.
+  return "%s %s%s%s" % (operation, "FROM=" if operation == "update" else "",
+    count1.logFormat(), " TO="+count2.logFormat() if operation == "update"\
+    else "")
+
+def recordBatch (username, remoteAddress, operations):
+  # Logs a batch of count operations by the given user from the given
+  # address (which may be None) as a single message, and audits them
+  # individually.  `operations` is a list of (operation, count1,
+  # count2) tuples, with arguments as for countAudit; the counts must
+  # not be modified subsequently.
+  record("[WRPT] %s %s batch %s" % (remoteAddress or "unknown", username,
+    " ".join(operationFormat(*o) for o in operations)),
+    [countAudit(username, remoteAddress, *o) for o in operations])
+
+def snapshot (count):
+  # Returns a copy of a count, for recording its values before
+  # modification or deletion.
+  return copy.copy(count)
+
+def record (message, audits):
+  # Queues a log message (which may be None) and a list of
+  # CountAudits for writing.
+  global _thread
+  with _lock:
+    if _thread == None or not _thread.is_alive():
+      _thread = threading.Thread(target=writer, name="wrpt-audit",
+        daemon=True)
+      _thread.start()
+  _queue.put((message, audits))
+
+def flush ():
+  # Waits until all queued records have been written.
+  _queue.join()
+
+def write (messages, audits):
+  for m in messages: logging.getLogger("wrpt").info(m)
+  close_old_connections()
+  try:
+    CountAudit.objects.bulk_create(audits)
+  except Exception:
+    logging.getLogger("wrpt").exception(
+      "[WRPT] error writing %d count audit records" % len(audits))
+  finally:
+    close_old_connections()
+
+def writer ():
+  while True:
+    items = [_queue.get()]
+    deadline = time.monotonic() + flushInterval
+    while sum(len(a) for _, a in items) < batchSize:
+      try:
+        items.append(_queue.get(timeout=max(0, deadline-time.monotonic())))
+      except queue.Empty:
+        break
+    try:
+      write([m for m, _ in items if m != None],
+        [a for _, l in items for a in l])
+    finally:
+      for i in items: _queue.task_done()
+
+@atexit.register
+def drain ():
+  # Waits (boundedly) for queued records to be written.
+  deadline = time.monotonic() + 10
+  while _queue.unfinished_tasks > 0 and _thread != None and\
+    _thread.is_alive() and time.monotonic() < deadline:
+    time.sleep(0.05)
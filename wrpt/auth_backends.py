@@ -19,7 +19,12 @@ class WrptUserModelBackend (ModelBackend):
     except WrptUser.DoesNotExist:
       return None
   def get_user (self, user_id):
+    # Called on every request by a logged-in user.  The user's school
+    # is loaded in the same query, as views check it to determine
+    # permissions.  (The user is not cached: the cache is kept in the
+    # database in production, so a cached lookup would save nothing,
+    # and the user object carries the password hash.)
     try:
-      return WrptUser.objects.get(pk=user_id)
+      return WrptUser.objects.select_related("school").get(pk=user_id)
     except WrptUser.DoesNotExist:
       return None
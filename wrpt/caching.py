@@ -0,0 +1,138 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Caching.  For invalidation to be effective the cache must be shared
+# by all server processes, hence the file-based cache configured in
+# the site settings (a per-process memory cache would leave other
+# Gunicorn workers serving stale data).
+
+import datetime
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+programListingKey = "wrpt:programListing"
+
+def getProgramListing (today):
+  # Returns the cached home page program listing (an HTML fragment),
+  # or None.  Since program currency depends on the date, a listing
+  # rendered on a previous day is disregarded.
+  v = cache.get(programListingKey)
+  if v != None and v[0] == today:
+    return v[1]
+  else:
+    return None
+
+def setProgramListing (today, listing):
+  cache.set(programListingKey, (today, listing), None)
+
+def invalidateProgramListing ():
+  cache.delete(programListingKey)
+
+# The program choices of the admin's program filters, as [(program
+# ID, program name), ...].
+
+programChoicesKey = "wrpt:programChoices"
+
+def getProgramChoices ():
+  return cache.get(programChoicesKey)
+
+def setProgramChoices (choices):
+  cache.set(programChoicesKey, choices, None)
+
+def invalidateProgramChoices ():
+  cache.delete(programChoicesKey)
+
+# Program data versions.  Each program has a version stamp, the time
+# (in seconds since the epoch) at which any of the program's data
+# (counts, classrooms, event dates, or the program itself) last
+# changed, which serves both to key cached pages and as the pages'
+# modification time.  A missing stamp (e.g., one evicted from the
+# cache) is simply reset to the current time.
+
+def programVersionKey (programId):
+  return "wrpt:programVersion:%d" % programId
+
+def getProgramVersion (programId):
+  key = programVersionKey(programId)
+  v = cache.get(key)
+  if v == None:
+    cache.add(key, time.time(), None)
+    v = cache.get(key)
+  return v
+
+def bumpProgramVersion (*programIds):
+  now = time.time()
+  cache.set_many(dict((programVersionKey(id), now) for id in programIds),
+    None)
+
+pageTimeout = 24*60*60 # seconds
+
+def cachedPage (programIdOf, userIndependent=False):
+  # View decorator that caches responses to anonymous GET requests
+  # under the program's data version and answers conditional requests
+  # (If-None-Match, If-Modified-Since).  `programIdOf` maps the view's
+  # 'id' argument to a program ID, or returns None if there is no
+  # such object.  Pages also depend on the date (which event dates are
+  # past, whether the program is current), so the date is
+  # incorporated as well.  Pages seen by logged-in users incorporate
+  # user-specific content (forms, messages) and are not cached, unless
+  # `userIndependent` is true.  Requests being profiled (see
+  # wrpt.profiling) bypass the cache.
+  def decorator (view):
+    @functools.wraps(view)
+    def wrapper (request, id):
+      if request.method != "GET" or\
+        (request.user.is_authenticated and not userIndependent) or\
+        getattr(request, "wrptProfiling", False):
+        return view(request, id)
+      programId = programIdOf(id)
+      if programId == None: return view(request, id)
+      today = datetime.date.today()
+      version = getProgramVersion(programId)
+      tag = hashlib.md5(("%r %s %s" % (version, today,
+        request.get_full_path())).encode("UTF-8")).hexdigest()
+      etag = '"%s"' % tag
+      lastModified = int(max(version, time.mktime(today.timetuple())))
+      r = get_conditional_response(request, etag, lastModified)
+      if r != None:
+        r["ETag"] = etag
+        r["Last-Modified"] = http_date(lastModified)
+        return r
+      key = "wrpt:page:%s" % tag
+      page = cache.get(key)
+      if page != None:
+        r = HttpResponse(page[0], content_type=page[1])
+      else:
+        r = view(request, id)
+        # Only successful responses are cached (the program view
+        # redirects one-classroom programs, for example).
+        if r.status_code != 200: return r
+        cache.set(key, (r.content, r["Content-Type"]), pageTimeout)
+      r["ETag"] = etag
+      r["Last-Modified"] = http_date(lastModified)
+      return r
+    return wrapper
+  return decorator
+
+def cachedProgramValue (programId, name, compute):
+  # Returns a value derived from the program's data, computing it by
+  # calling `compute` and caching it under the program's data version
+  # and the date if necessary.  `name` identifies the value within the
+  # program.  Unlike cached pages, such values are shared by all users.
+  today = datetime.date.today()
+  key = "wrpt:value:%s" % hashlib.md5(("%d %r %s %s" % (programId,
+    getProgramVersion(programId), today, name)).encode("UTF-8")).hexdigest()
+  v = cache.get(key)
+  if v == None:
+    v = compute()
+    cache.set(key, v, pageTimeout)
+  return v
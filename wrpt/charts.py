@@ -0,0 +1,91 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Server-side rendering of the cumulative performance charts as
+# inline SVG.  Charts are rendered from the columnar chart data
+# returned by wrpt.views.chartData, and so carry the same content as
+# the JSON served to clients: one line per series, plus a horizontal
+# goal line if the chart calls for it and the program has a goal.
+# The drawing follows the conventions of the line charts previously
+# drawn client-side (colors, titles, fixed 0-100% vertical axis).
+
+import math
+
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Chart geometry, in SVG user units.  The charts scale to the width
+# of the containing element.
+width, height = 800, 500
+plotLeft, plotTop, plotRight, plotBottom = 80, 60, 610, 420
+legendLeft = 630
+legendLabelLength = 24 # characters
+minimumLabelSpacing = 45
+
+colors = ["#3366CC", "#DC3912", "#FF9900", "#109618", "#990099",
+  "#0099C6", "#DD4477", "#66AA00", "#B82E2E", "#316395"]
+
+def truncate (s, length):
+  if len(s) > length:
+    return s[:length-1] + "…"
+  else:
+    return s
+
+def renderChart (data, chart, title):
+  # Returns the SVG rendering of `chart`, one of the charts in `data`
+  # (see wrpt.views.chartData).
+  n = len(data["labels"])
+  plotWidth = plotRight - plotLeft
+  plotHeight = plotBottom - plotTop
+  goal = data["goal"] if chart["plotGoal"] else None
+  values = [v for s in chart["series"] for v in s["values"] if v != None]
+  if goal != None: values.append(goal)
+  # The vertical axis spans 0-100%, extended in steps of 20% in the
+  # unlikely event a value exceeds 100%.
+  top = max([100] + [int(math.ceil(v/20))*20 for v in values])
+  def x (i):
+    return round(plotLeft + (i+0.5)*plotWidth/n, 1)
+  def y (v):
+    return round(plotBottom - v*plotHeight/top, 1)
+  yTicks = [{ "y": y(v), "label": "%d%%" % v } for v in range(0, top+1, 20)]
+  # Date labels are thinned as necessary to avoid overlapping.
+  step = max(1, int(math.ceil(n*minimumLabelSpacing/plotWidth)))
+  xTicks = [{ "x": x(i), "label": l } for i, l in enumerate(data["labels"])\
+    if i%step == 0]
+  series = []
+  for j, s in enumerate(chart["series"]):
+    # Null values (future dates) break the line.
+    segments = []
+    points = []
+    for i, v in enumerate(s["values"]):
+      if v != None:
+        if len(segments) == 0 or s["values"][i-1] == None:
+          segments.append([])
+        segments[-1].append("%s,%s" % (x(i), y(v)))
+        points.append({ "x": x(i), "y": y(v), "title": "%s, %s: %d%%" %\
+          (s["label"], data["labels"][i], v) })
+    series.append({ "label": s["label"], "color": colors[j%len(colors)],
+      "segments": [" ".join(l) for l in segments], "points": points })
+  if goal != None:
+    series.append({ "label": "Goal",
+      "color": colors[len(chart["series"])%len(colors)],
+      "segments": ["%s,%s %s,%s" % (plotLeft, y(goal), plotRight,
+        y(goal))], "points": [], "dashed": True })
+  for j, s in enumerate(series):
+    s["legendY"] = plotTop + 10 + j*22
+    s["legendLabel"] = truncate(s["label"], legendLabelLength)
+  yAxisLabel = chart["yAxisLabel"]
+  return mark_safe(render_to_string("wrpt/chart.svg", { "name": chart["name"],
+    "title": title, "width": width, "height": height,
+    "plotLeft": plotLeft, "plotTop": plotTop, "plotRight": plotRight,
+    "plotBottom": plotBottom, "plotCenter": (plotLeft+plotRight)//2,
+    "plotMiddle": (plotTop+plotBottom)//2, "legendLeft": legendLeft,
+    "xTicks": xTicks, "yTicks": yTicks, "series": series,
+    "yAxisTitle": yAxisLabel[:1].upper() + yAxisLabel[1:] + " percentage" }))
+
+def renderCharts (data, title):
+  # Returns { chart name: SVG } for all charts in `data`.
+  return dict((c["name"], renderChart(data, c, title)) for c in data["charts"])
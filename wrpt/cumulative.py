@@ -0,0 +1,112 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Maintenance of the CumulativeStats table, which holds, for each
+# classroom and each event date not in the future, the classroom's
+# cumulative sums and percentages through that date.  A classroom's
+# rows always form a prefix of its schedule (i.e., rows exist for the
+# first N event dates, for some N), which allows the table to be
+# maintained incrementally: when a count changes, the rows for the
+# count's date and all later dates are discarded and recomputed
+# forward from the preceding row.  Rows for event dates that have
+# passed since the table was last updated are added lazily, when the
+# table is read.
+
+import datetime
+
+from django.db import transaction
+
+from wrpt.models import Classroom, Count, CumulativeStats, EventDate
+from wrpt.stats import ClassroomStats
+
+def computeCumulativeStats (classroom, dates, map, prev=None):
+  # Returns [CumulativeStats, ...] (unsaved), one per date.  `dates`
+  # must be the classroom's event dates following the date of `prev`
+  # (or all event dates, if `prev` is None), in order, and none may be
+  # in the future.  The computation mirrors
+  # wrpt.stats.computeClassroomData, including the penalty for missing
+  # counts.
+  rows = []
+  lastEnrollment = prev.enrollment if prev != None else classroom.enrollment
+  for d in dates:
+    if (classroom.pk, d.pk) in map:
+      c = map[(classroom.pk, d.pk)]
+      lastEnrollment = c.enrollment
+    else:
+      c = Count(enrollment=lastEnrollment, value=0)
+    s = ClassroomStats(d, c, prev, computeEventDatePercentages=False)
+    prev = CumulativeStats(classroom=classroom, eventDate=d,
+      enrollment=lastEnrollment, presentSum=s.presentSum,
+      activeSum=s.activeSum, inactiveSum=s.inactiveSum,
+      combinedCumPct=s.combinedCumPct, activeCumPct=s.activeCumPct,
+      inactiveCumPct=s.inactiveCumPct)
+    rows.append(prev)
+  return rows
+
+def loadCumulativeStats (classrooms, dates, map, today):
+  # Returns { classroom ID: { event date ID: CumulativeStats } }
+  # covering, for each classroom, every date in `dates` (the
+  # classrooms' schedule, in order) not after `today`.  Missing rows
+  # are computed and stored.  `map` must hold the classrooms' counts,
+  # keyed as in wrpt.stats.computeClassroomData.
+  past = [d for d in dates if d.date <= today]
+  stored = dict((c.pk, {}) for c in classrooms)
+  for r in CumulativeStats.objects.filter(classroom__in=classrooms):
+    stored[r.classroom_id][r.eventDate_id] = r
+  result = {}
+  new = []
+  invalid = []
+  for c in classrooms:
+    rows = stored[c.pk]
+    n = 0
+    while n < len(past) and past[n].pk in rows: n += 1
+    l = [rows[d.pk] for d in past[:n]]
+    if len(rows) > n:
+      # Rows beyond the valid prefix (e.g., for an event date that has
+      # since been moved) must be discarded.
+      invalid.append((c, [d.pk for d in past[:n]]))
+    if n < len(past):
+      computed = computeCumulativeStats(c, past[n:], map,
+        l[-1] if n > 0 else None)
+      new.extend(computed)
+      l.extend(computed)
+    result[c.pk] = dict((r.eventDate_id, r) for r in l)
+  if len(invalid) > 0 or len(new) > 0:
+    with transaction.atomic():
+      for c, keep in invalid:
+        CumulativeStats.objects.filter(classroom=c)\
+          .exclude(eventDate__in=keep).delete()
+      # Conflicts can arise only if another process is concurrently
+      # storing the same rows.
+      CumulativeStats.objects.bulk_create(new, ignore_conflicts=True)
+  return result
+
+def refreshCumulativeStats (classroomId, fromDate=None, today=None):
+  # Discards the classroom's rows for event dates on or after
+  # `fromDate` (all rows, if None) and recomputes them forward from
+  # the preceding row.
+  classroom = Classroom.objects.filter(pk=classroomId).first()
+  if classroom == None: return
+  if today == None: today = datetime.date.today()
+  with transaction.atomic():
+    rows = CumulativeStats.objects.filter(classroom=classroom)
+    if fromDate != None: rows = rows.filter(eventDate__date__gte=fromDate)
+    rows.delete()
+    prev = CumulativeStats.objects.filter(classroom=classroom)\
+      .select_related("eventDate").order_by("-eventDate__date").first()
+    dates = EventDate.objects.filter(schedule__program__classroom=classroom,
+      date__lte=today).order_by("date")
+    if prev != None: dates = dates.filter(date__gt=prev.eventDate.date)
+    map = dict(((classroom.pk, c.eventDate_id), c)\
+      for c in Count.objects.filter(classroom=classroom, eventDate__in=dates))
+    CumulativeStats.objects.bulk_create(
+      computeCumulativeStats(classroom, dates, map, prev),
+      ignore_conflicts=True)
+
+def discardCumulativeStats (**filters):
+  # Discards rows selected by `filters`; they will be recomputed when
+  # next read.
+  CumulativeStats.objects.filter(**filters).delete()
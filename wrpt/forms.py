@@ -9,15 +9,34 @@ from django.core.validators import ValidationError
 
 import datetime
 
-from wrpt.models import Count, EventDate
+from wrpt.loaders import ClassroomDataLoader
+from wrpt.models import EventDate, Program, schoolYearValidator
 
 maxValue = 1000
 
-class CountForm (forms.Form):
-  eventDate = forms.ModelChoiceField(queryset=EventDate.objects.all())
+def cleanCountValues (program, d):
+  # Validation rules for submitted count values, shared by CountForm
+  # and CountRowForm.  `d` is the form's cleaned data, which is
+  # normalized in place.  Blank values are treated as a command to
+  # delete an existing count.
+  if program.splitCounts:
+    countSubmitted = (d["activeValue"] != None or d["inactiveValue"] != None)
+    if countSubmitted:
+      d["activeValue"] = d["activeValue"] or 0
+      d["inactiveValue"] = d["inactiveValue"] or 0
+      d["value"] = d["activeValue"] + d["inactiveValue"]
+  else:
+    countSubmitted = (d["value"] != None)
+  if countSubmitted and d["value"]+d["absentees"] > d["enrollment"]:
+    raise ValidationError(
+      "Participants plus absentees exceeds classroom enrollment.")
+  d["comments"] = d["comments"].strip()
+
+class CountValuesForm (forms.Form):
+  # The count value fields, common to CountForm and CountRowForm.
   # Without 'localize=True' below, Django uses a bizarro widget that
   # doesn't check for valid integers?!
-  # Enrollment is required, but will receive an initial value below.
+  # Enrollment is required, but will receive an initial value.
   enrollment = forms.IntegerField(min_value=1, max_value=maxValue,
     required=True, localize=True)
   # Note that the value fields are allowed to be blank: blank values
@@ -32,40 +51,42 @@ class CountForm (forms.Form):
     required=True, localize=True, initial=0)
   comments = forms.CharField(max_length=1000, required=False,
     widget=forms.TextInput(attrs={ "size": "100" }))
+  def disableFields (self, program, canSubmit):
+    if program.splitCounts:
+      self.fields["value"].disabled = True
+    else:
+      self.fields["activeValue"].disabled = True
+      self.fields["inactiveValue"].disabled = True
+    if not canSubmit:
+      for f in self.fields.values(): f.disabled = True
+
+class CountForm (CountValuesForm):
+  eventDate = forms.ModelChoiceField(queryset=EventDate.objects.all())
+  field_order = ["eventDate"]
   def __init__ (self, *args, **kwargs):
+    # A ClassroomDataLoader may be supplied to share data already
+    # loaded for the request.
     self.classroom = kwargs.pop("classroom")
     canSubmit = kwargs.pop("canSubmit")
+    loader = kwargs.pop("loader", None)
+    if loader == None: loader = ClassroomDataLoader(self.classroom)
     super().__init__(*args, **kwargs)
-    dates = EventDate.objects.filter(schedule=self.classroom.program.schedule)\
-      .order_by("date")
-    self.fields["eventDate"].queryset = dates
+    f = self.fields["eventDate"]
+    # The queryset is used only to validate submissions; the choices
+    # are rendered from the loaded dates.
+    f.queryset = EventDate.objects.filter(
+      schedule=self.classroom.program.schedule_id)
+    f.choices = ([("", f.empty_label)] if f.empty_label != None else []) +\
+      [(f.prepare_value(d), f.label_from_instance(d)) for d in loader.dates]
     # Set the initial date to the most recent date not in the future.
     t = datetime.date.today()
-    l = [d for d in dates if d.date <= t]
-    if len(l) > 0: self.fields["eventDate"].initial = l[-1]
+    l = [d for d in loader.dates if d.date <= t]
+    if len(l) > 0: f.initial = l[-1]
     # The initial enrollment value is either the value supplied by the
     # most recent count for this classroom, or the classroom's nominal
     # value.
-    counts = list(Count.objects.filter(program=self.classroom.program,
-      classroom=self.classroom).select_related("eventDate")\
-      .order_by("eventDate__date"))
-    if len(counts) > 0:
-      self.fields["enrollment"].initial = counts[-1].enrollment
-    else:
-      self.fields["enrollment"].initial = self.classroom.enrollment
-    if self.classroom.program.splitCounts:
-      self.fields["value"].disabled = True
-    else:
-      self.fields["activeValue"].disabled = True
-      self.fields["inactiveValue"].disabled = True
-    if not canSubmit:
-      self.fields["eventDate"].disabled = True
-      self.fields["enrollment"].disabled = True
-      self.fields["value"].disabled = True
-      self.fields["activeValue"].disabled = True
-      self.fields["inactiveValue"].disabled = True
-      self.fields["absentees"].disabled = True
-      self.fields["comments"].disabled = True
+    self.fields["enrollment"].initial = loader.lastEnrollment
+    self.disableFields(self.classroom.program, canSubmit)
   def clean (self):
     cleaned_data = super().clean()
     # Bail out if there are already individual field errors.
@@ -75,16 +96,66 @@ class CountForm (forms.Form):
     d = cleaned_data
     if d["eventDate"].date > datetime.date.today():
       raise ValidationError({ "eventDate": "Date is in the future." })
-    if self.classroom.program.splitCounts:
-      countSubmitted = (d["activeValue"] != None or d["inactiveValue"] != None)
-      if countSubmitted:
-        d["activeValue"] = d["activeValue"] or 0
-        d["inactiveValue"] = d["inactiveValue"] or 0
-        d["value"] = d["activeValue"] + d["inactiveValue"]
-    else:
-      countSubmitted = (d["value"] != None)
-    if countSubmitted and d["value"]+d["absentees"] > d["enrollment"]:
-      raise ValidationError(
-        "Participants plus absentees exceeds classroom enrollment.")
-    d["comments"] = d["comments"].strip()
+    cleanCountValues(self.classroom.program, d)
+    return d
+
+class CountRowForm (CountValuesForm):
+  # One row (classroom) of the bulk count entry page.  The event date
+  # is common to all rows, and the checks that depend only on the
+  # program and date (program not concluded, date not in the future)
+  # are performed once for the page by the view.
+  def __init__ (self, *args, **kwargs):
+    self.program = kwargs.pop("program")
+    canSubmit = kwargs.pop("canSubmit")
+    super().__init__(*args, **kwargs)
+    self.fields["comments"].widget.attrs["size"] = "40"
+    self.disableFields(self.program, canSubmit)
+  def clean (self):
+    cleaned_data = super().clean()
+    # Bail out if there are already individual field errors.
+    if len(self.errors.as_data()) > 0: return cleaned_data
+    cleanCountValues(self.program, cleaned_data)
+    return cleaned_data
+
+class DumpCountsForm (forms.Form):
+  # Optional filters for the count dump, supplied as query parameters.
+  program = forms.ModelChoiceField(queryset=Program.objects.all(),
+    required=False)
+  schoolYear = forms.CharField(required=False,
+    validators=[schoolYearValidator])
+  startDate = forms.DateField(required=False)
+  endDate = forms.DateField(required=False)
+
+class SearchForm (forms.Form):
+  q = forms.CharField(required=False, max_length=200, label="Search")
+
+class ImportCountsForm (forms.Form):
+  file = forms.FileField(help_text="A CSV file in the format of the " +\
+    "count dump")
+  checkOnly = forms.BooleanField(required=False, label="Check only",
+    help_text="Validate the file without importing it")
+
+class ImportRosterForm (forms.Form):
+  # Files, if uploaded, replace the corresponding pasted texts.
+  program = forms.ModelChoiceField(queryset=Program.objects\
+    .select_related("school").order_by("-schoolYear", "school__name"))
+  roster = forms.CharField(required=False,
+    widget=forms.Textarea(attrs={ "rows": "15", "cols": "40" }),
+    help_text="One classroom per line: name, enrollment")
+  rosterFile = forms.FileField(required=False, label="Roster file",
+    help_text="Or upload a CSV file")
+  dates = forms.CharField(required=False, label="Event dates",
+    widget=forms.Textarea(attrs={ "rows": "15", "cols": "20" }),
+    help_text="One date per line, e.g., 2014-10-08; added to the " +\
+    "program's schedule")
+  datesFile = forms.FileField(required=False, label="Event dates file",
+    help_text="Or upload a text file")
+  def clean (self):
+    d = super().clean()
+    for f in ["roster", "dates"]:
+      if d.get(f+"File") != None:
+        try:
+          d[f] = d[f+"File"].read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+          self.add_error(f+"File", "File is not UTF-8 encoded text.")
     return d
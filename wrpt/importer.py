@@ -0,0 +1,289 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Bulk imports.
+#
+# Counts are imported from CSV files in the format produced by the
+# count dump (see views.dumpCounts): a header row followed by rows of
+#
+#   program, eventDate, classroom, enrollment, value, activeValue,
+#   inactiveValue, absentees, comments
+#
+# where a program is identified by its name (school year and school
+# name), an event date by its date (YYYY-MM-DD), and a classroom by
+# its name within the program.  Each row creates a count or replaces
+# an existing count's values.  The programs, event dates, classrooms
+# and existing counts referenced by the file are loaded up front, in
+# a handful of queries, and every row is validated (by Count.clean)
+# against them before anything is written; if any row is invalid,
+# nothing is written.  Otherwise, all counts are written in one
+# transaction, in bulk.
+#
+# A program's roster is imported from a list of classrooms (a name and
+# an enrollment per line, separated by a comma or tab) and a list of
+# event dates (one per line), the latter being added to the program's
+# schedule.  The changes are computed first, for review, and then
+# applied in bulk.  Classrooms are created or have their enrollments
+# updated, and event dates are created; nothing is deleted, as
+# deleting a classroom or event date deletes its counts.
+
+import csv
+import datetime
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from wrpt.models import Classroom, Count, EventDate, Program
+from wrpt.signals import classroomsChanged, countsChanged, eventDatesChanged
+
+columns = ["program", "eventDate", "classroom", "enrollment", "value",
+  "activeValue", "inactiveValue", "absentees", "comments"]
+valueFields = ["enrollment", "value", "activeValue", "inactiveValue",
+  "absentees", "comments"]
+batchSize = 500 # rows per INSERT/UPDATE statement
+
+def errorMessages (e):
+  # Returns the messages of a ValidationError, prefixed by field
+  # names where applicable.
+  if hasattr(e, "error_dict"):
+    return ["%s: %s" % (f, m) for f, l in sorted(e.message_dict.items())\
+      for m in l]
+  else:
+    return e.messages
+
+def parseInteger (s):
+  s = s.strip()
+  if s == "": return None
+  try:
+    return int(s)
+  except ValueError:
+    raise ValidationError("Enter a whole number.")
+
+def importCounts (file, commit=True):
+  # Imports counts from `file`, a text file.  Returns (errors,
+  # operations), where errors is a list of error messages and
+  # operations is a list of (operation, count1, count2) tuples as for
+  # audit.recordBatch.  If there are errors, or if `commit` is false,
+  # nothing is written.
+  reader = csv.reader(file)
+  header = next(reader, None)
+  if header == None: return (["File is empty."], [])
+  header = [h.strip() for h in header]
+  if sorted(header) != sorted(columns):
+    return (["Header must contain the columns %s." % ", ".join(columns)], [])
+  rows = [(reader.line_num, r) for r in reader\
+    if any(v.strip() != "" for v in r)]
+  rows = [(line, dict(zip(header, r)) if len(r) == len(header) else None)\
+    for line, r in rows]
+  # Load everything the file references.
+  programNames = set(r["program"].strip() for _, r in rows if r != None)
+  programs = dict((str(p), p) for p in Program.objects\
+    .filter(schoolYear__in=set(n[:9] for n in programNames))\
+    .select_related("school"))
+  programs = dict((n, p) for n, p in programs.items() if n in programNames)
+  dates = {}
+  for d in EventDate.objects.filter(schedule__in=set(p.schedule_id\
+    for p in programs.values())):
+    dates[(d.schedule_id, d.date)] = d
+  classrooms = {}
+  for c in Classroom.objects.filter(program__in=programs.values()):
+    classrooms[(c.program_id, c.name)] = c
+  existing = {}
+  for c in Count.objects.filter(program__in=programs.values()):
+    existing[(c.classroom_id, c.eventDate_id)] = c
+  # Validate.
+  errors = []
+  seen = set()
+  created = []
+  updated = []
+  operations = []
+  for line, r in rows:
+    def error (message):
+      errors.append("Line %d: %s" % (line, message))
+    if r == None:
+      error("Wrong number of columns.")
+      continue
+    p = programs.get(r["program"].strip())
+    if p == None:
+      error("No such program: %s" % r["program"].strip())
+      continue
+    try:
+      date = datetime.datetime.strptime(r["eventDate"].strip(),
+        "%Y-%m-%d").date()
+    except ValueError:
+      error("Invalid event date: %s" % r["eventDate"].strip())
+      continue
+    d = dates.get((p.schedule_id, date))
+    if d == None:
+      error("Event date is not in program's schedule: %s" % date)
+      continue
+    cr = classrooms.get((p.pk, r["classroom"].strip()))
+    if cr == None:
+      error("No such classroom in program: %s" % r["classroom"].strip())
+      continue
+    if (cr.pk, d.pk) in seen:
+      error("Duplicate count for classroom %s on %s." % (cr.name, date))
+      continue
+    seen.add((cr.pk, d.pk))
+    values = { "comments": r["comments"].strip() }
+    e = {}
+    for f in valueFields[:-1]:
+      try:
+        values[f] = parseInteger(r[f])
+      except ValidationError as x:
+        e[f] = x.messages
+        values[f] = None
+    if values["absentees"] == None: values["absentees"] = 0
+    c = Count(program=p, eventDate=d, classroom=cr, **values)
+    try:
+      if len(e) > 0: raise ValidationError(e)
+      c.clean_fields(exclude=["program", "eventDate", "classroom"])
+      c.clean()
+    except ValidationError as x:
+      for m in errorMessages(x): error(m)
+      continue
+    old = existing.get((cr.pk, d.pk))
+    if old == None:
+      created.append(c)
+    elif any(getattr(c, f) != getattr(old, f) for f in valueFields):
+      c.pk = old.pk
+      updated.append(c)
+      operations.append(("update", old, c))
+  # IDs of created counts are not available on all databases.
+  operations += [("create", c, None) for c in created]
+  if len(errors) > 0 or not commit: return (errors, operations)
+  if len(operations) > 0:
+    changed = {}
+    for c in created+updated:
+      classroomIds, fromDate = changed.get(c.program_id, (set(), None))
+      changed[c.program_id] = (classroomIds | { c.classroom_id },
+        min(fromDate or c.eventDate.date, c.eventDate.date))
+    with transaction.atomic():
+      Count.objects.bulk_create(created, batch_size=batchSize)
+      Count.objects.bulk_update(updated, valueFields, batch_size=batchSize)
+      for programId, (classroomIds, fromDate) in changed.items():
+        countsChanged(programId, classroomIds, fromDate)
+  return (errors, operations)
+
+def parseRoster (text):
+  # Returns (errors, [(line number, name, enrollment), ...]).
+  lines = text.splitlines()
+  reader = csv.reader(lines, delimiter="\t" if "\t" in text else ",")
+  errors = []
+  roster = []
+  for i, r in enumerate(reader):
+    r = [v.strip() for v in r]
+    if all(v == "" for v in r): continue
+    if len(r) != 2:
+      errors.append("Roster line %d: Expected a name and an enrollment." %\
+        (i+1))
+      continue
+    if len(roster) == 0 and len(errors) == 0 and\
+      r[1].lower() == "enrollment":
+      continue # a header
+    try:
+      roster.append((i+1, r[0], parseInteger(r[1])))
+    except ValidationError as x:
+      errors.append("Roster line %d: enrollment: %s" % (i+1, x.messages[0]))
+  return (errors, roster)
+
+def parseDates (text):
+  # Returns (errors, [(line number, date), ...]).  Dates may be in any
+  # format accepted by date form fields.
+  f = forms.DateField()
+  errors = []
+  dates = []
+  for i, l in enumerate(text.splitlines()):
+    if l.strip() == "": continue
+    try:
+      dates.append((i+1, f.clean(l.strip())))
+    except ValidationError as x:
+      errors.append("Dates line %d: %s" % (i+1, x.messages[0]))
+  return (errors, dates)
+
+def rosterChanges (program, roster, dates):
+  # Computes the changes a roster and list of event dates (as texts)
+  # would make to a program.  Returns (errors, changes), where changes
+  # is a dictionary:
+  #
+  #   { "createdClassrooms": [Classroom, ...], # unsaved
+  #     "updatedClassrooms": [(Classroom, old enrollment), ...],
+  #     "unchangedClassrooms": [Classroom, ...],
+  #     "omittedClassrooms": [Classroom, ...], # not in the roster
+  #     "createdDates": [EventDate, ...], # unsaved
+  #     "existingDates": [EventDate, ...] }
+  #
+  # Classrooms are listed by name, event dates by date.
+  errors, rows = parseRoster(roster)
+  existing = dict((c.name, c) for c in Classroom.objects.filter(
+    program=program))
+  changes = { "createdClassrooms": [], "updatedClassrooms": [],
+    "unchangedClassrooms": [] }
+  names = set()
+  for line, name, enrollment in rows:
+    c = Classroom(program=program, name=name, enrollment=enrollment)
+    try:
+      c.clean_fields(exclude=["program"])
+      c.clean()
+    except ValidationError as x:
+      for m in errorMessages(x): errors.append("Roster line %d: %s" %\
+        (line, m))
+      continue
+    if c.name in names:
+      errors.append("Roster line %d: Duplicate classroom: %s" % (line,
+        c.name))
+      continue
+    names.add(c.name)
+    old = existing.get(c.name)
+    if old == None:
+      changes["createdClassrooms"].append(c)
+    elif old.enrollment != c.enrollment:
+      changes["updatedClassrooms"].append((old, old.enrollment))
+      old.enrollment = c.enrollment
+    else:
+      changes["unchangedClassrooms"].append(old)
+  changes["omittedClassrooms"] = [c for n, c in existing.items()\
+    if n not in names]
+  e, dateRows = parseDates(dates)
+  errors += e
+  existingDates = dict((d.date, d) for d in EventDate.objects.filter(
+    schedule=program.schedule_id))
+  changes["createdDates"] = []
+  changes["existingDates"] = []
+  seen = set()
+  for line, date in dateRows:
+    if date in seen:
+      errors.append("Dates line %d: Duplicate date: %s" % (line, date))
+      continue
+    seen.add(date)
+    if date in existingDates:
+      changes["existingDates"].append(existingDates[date])
+    else:
+      changes["createdDates"].append(EventDate(schedule_id=program.schedule_id,
+        date=date))
+  for k in ["createdClassrooms", "unchangedClassrooms", "omittedClassrooms"]:
+    changes[k].sort(key=lambda c: c.name)
+  changes["updatedClassrooms"].sort(key=lambda t: t[0].name)
+  for k in ["createdDates", "existingDates"]:
+    changes[k].sort(key=lambda d: d.date)
+  return (errors, changes)
+
+def importRoster (program, changes):
+  # Applies changes computed by rosterChanges.
+  with transaction.atomic():
+    Classroom.objects.bulk_create(changes["createdClassrooms"],
+      batch_size=batchSize)
+    Classroom.objects.bulk_update([c for c, _ in\
+      changes["updatedClassrooms"]], ["enrollment"], batch_size=batchSize)
+    EventDate.objects.bulk_create(changes["createdDates"],
+      batch_size=batchSize)
+    if len(changes["createdClassrooms"]) +\
+      len(changes["updatedClassrooms"]) > 0:
+      classroomsChanged(program.pk, [c.pk for c, _ in\
+        changes["updatedClassrooms"]])
+    if len(changes["createdDates"]) > 0:
+      eventDatesChanged(program.schedule_id)
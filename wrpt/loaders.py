@@ -0,0 +1,42 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Request-scoped data loading.  A classroom page needs the classroom's
+# event dates and counts in several places (the count entry form and
+# the statistics); a loader fetches them once and is passed around.
+
+from wrpt.models import Count, EventDate
+
+class ClassroomDataLoader (object):
+  # Attributes:
+  #
+  #   classroom = Classroom
+  #   dates = [EventDate, ...] # the program's schedule, in order
+  #   counts = [Count, ...] # the classroom's counts, in date order
+  #   map = { (classroom ID, event date ID): Count } # as used by
+  #     wrpt.stats.computeClassroomData
+  #   lastEnrollment = int # the enrollment of the most recent count,
+  #     or the classroom's nominal enrollment if there are no counts
+  #
+  # The dates and counts may instead be supplied (e.g., from a program
+  # snapshot), in which case no queries are issued.
+  def __init__ (self, classroom, dates=None, counts=None):
+    self.classroom = classroom
+    if dates != None:
+      self.dates = dates
+    else:
+      self.dates = list(EventDate.objects.filter(
+        schedule=classroom.program.schedule_id).order_by("date"))
+    if counts != None:
+      self.counts = counts
+    else:
+      self.counts = list(Count.objects.filter(classroom=classroom)\
+        .select_related("eventDate").order_by("eventDate__date"))
+    self.map = dict(((classroom.pk, c.eventDate_id), c) for c in self.counts)
+    if len(self.counts) > 0:
+      self.lastEnrollment = self.counts[-1].enrollment
+    else:
+      self.lastEnrollment = classroom.enrollment
@@ -0,0 +1,205 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Benchmarks the statistics computations on in-memory (unsaved)
+# programs of increasing size, reporting for each benchmark and size
+# the median time over a number of repetitions and the peak memory
+# allocated (measured by tracemalloc, in a separate, warm-up run).
+# Results can be saved as a baseline and later runs compared against
+# it.  Comparisons are made on times relative to a fixed reference
+# workload run alongside each repetition, as the speed of a shared
+# machine can easily vary by a factor of two between runs.  A
+# comparison fails if any benchmark slowed by more than a tolerance
+# and by more than the measurement noise, taken to be `noiseFactor`
+# times the sum of the two runs' spreads (the median absolute
+# deviations of their relative times).  No database access takes
+# place.
+
+import datetime
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from wrpt.models import Classroom, Count, EventDate, Program, School
+from wrpt.stats import ClassroomStats, ProgramStats, computeClassroomData,\
+  numpy
+from wrpt.views import addProgramStats, addStandingsStatement
+
+defaultClassrooms = [10, 100, 500, 2000]
+defaultDates = [10, 30, 100]
+noiseFloor = 0.001 # seconds; faster measurements are never regressions
+noiseFactor = 3
+
+def makeFixture (numClassrooms, numDates, seed=0):
+  # Returns (program, classrooms, dates, map, today) for a split-count
+  # program in which all dates are past and 10% of counts are missing.
+  rng = random.Random(seed)
+  program = Program(pk=1, school=School(pk=1, name="Benchmark"),
+    schoolYear="2000-2001", splitCounts=True, participationGoal=50)
+  classrooms = [Classroom(pk=i+1, program=program, name="Room %d" % (i+1),
+    enrollment=rng.randint(18, 32)) for i in range(numClassrooms)]
+  start = datetime.date(2000, 9, 1)
+  dates = [EventDate(pk=j+1, date=start+datetime.timedelta(weeks=j))\
+    for j in range(numDates)]
+  map = {}
+  for c in classrooms:
+    for d in dates:
+      if rng.random() < 0.1: continue
+      absentees = rng.randint(0, 3)
+      value = rng.randint(0, c.enrollment-absentees)
+      activeValue = rng.randint(0, value)
+      map[(c.pk, d.pk)] = Count(program=program, eventDate=d, classroom=c,
+        enrollment=c.enrollment, value=value, activeValue=activeValue,
+        inactiveValue=value-activeValue, absentees=absentees)
+  return program, classrooms, dates, map, dates[-1].date
+
+def constructClassroomStats (program, classrooms, dates, map, today):
+  for c in classrooms:
+    prev = None
+    for d in dates:
+      count = map.get((c.pk, d.pk))
+      if count == None: count = Count(enrollment=c.enrollment, value=0)
+      prev = ClassroomStats(d, count, prev)
+
+def constructProgramStats (program, classrooms, dates, map, today):
+  for c in classrooms:
+    for d in dates:
+      ProgramStats(d, 1, 2, 3, 4, 5, 6)
+
+def classroomData (program, classrooms, dates, map, today):
+  for c in classrooms:
+    computeClassroomData(dates, map, c, today)
+
+def programStats (engine):
+  def f (program, classrooms, dates, map, today):
+    with override_settings(WRPT_PROGRAM_STATS_ENGINE=engine):
+      addProgramStats({ "program": program }, dates, map, classrooms, today,
+        "combinedCumPct")
+  return f
+
+def standingsStatement (program, classrooms, dates, map, today):
+  context = { "program": program }
+  with override_settings(WRPT_PROGRAM_STATS_ENGINE="python"):
+    addProgramStats(context, dates, map, classrooms, today, "combinedCumPct")
+  return lambda: addStandingsStatement(context, "combinedCumPct")
+
+# (name, function, prepared).  If `prepared` is true, the function
+# performs any setup and returns the function to be measured.
+benchmarks = [
+  ("ClassroomStats", constructClassroomStats, False),
+  ("ProgramStats", constructProgramStats, False),
+  ("computeClassroomData", classroomData, False),
+  ("addProgramStats[python]", programStats("python"), False),
+  ("addProgramStats[numpy]", programStats("numpy"), False),
+  ("addStandingsStatement", standingsStatement, True)
+]
+
+def reference ():
+  # A fixed workload against which benchmarks are timed, so that
+  # comparisons are unaffected by the machine's speed varying between
+  # runs.
+  d = {}
+  for i in range(20000): d[i%1000] = d.get(i%1000, 0) + i*0.5
+  return sorted(d.values())
+
+def measure (f, repeat):
+  # Returns (median time in seconds, median time relative to the
+  # reference workload, median absolute deviation of the relative
+  # times, peak memory in bytes).  Each repetition of `f` is paired
+  # with a run of the reference workload.
+  tracemalloc.start()
+  try:
+    f()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  times = []
+  relativeTimes = []
+  for i in range(repeat):
+    start = time.perf_counter()
+    reference()
+    r = time.perf_counter() - start
+    start = time.perf_counter()
+    f()
+    t = time.perf_counter() - start
+    times.append(t)
+    relativeTimes.append(t/r)
+  median = statistics.median(relativeTimes)
+  return statistics.median(times), median,\
+    statistics.median(abs(t-median) for t in relativeTimes), peak
+
+class Command (BaseCommand):
+  help = "Benchmarks the statistics computations."
+  def add_arguments (self, parser):
+    parser.add_argument("--classrooms", type=int, nargs="+",
+      default=defaultClassrooms,
+      help="numbers of classrooms (default: %s)" %\
+      " ".join(str(n) for n in defaultClassrooms))
+    parser.add_argument("--dates", type=int, nargs="+", default=defaultDates,
+      help="numbers of event dates (default: %s)" %\
+      " ".join(str(n) for n in defaultDates))
+    parser.add_argument("--benchmark", nargs="+",
+      choices=[b[0] for b in benchmarks],
+      help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=9,
+      help="repetitions per measurement (default: 9)")
+    parser.add_argument("--save", metavar="FILE",
+      help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE",
+      help="compare the results against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+      help="fractional slowdown tolerated when comparing (default: 0.25)")
+  def handle (self, *args, **options):
+    if options["repeat"] < 1: raise CommandError("--repeat must be positive")
+    if min(options["classrooms"] + options["dates"]) < 1:
+      raise CommandError("sizes must be positive")
+    selected = [b for b in benchmarks if options["benchmark"] == None or\
+      b[0] in options["benchmark"]]
+    if numpy == None:
+      self.stderr.write("NumPy is not installed, skipping numpy benchmark")
+      selected = [b for b in selected if b[0] != "addProgramStats[numpy]"]
+    baseline = None
+    if options["compare"] != None:
+      try:
+        with open(options["compare"]) as f: baseline = json.load(f)
+      except (OSError, ValueError) as e:
+        raise CommandError("error reading baseline: %s" % e)
+    results = {}
+    regressions = []
+    self.stdout.write("%-24s %12s %12s %12s %10s" % ("benchmark", "size",
+      "time (ms)", "peak (KiB)", "vs. base"))
+    for numClassrooms in options["classrooms"]:
+      for numDates in options["dates"]:
+        size = "%dx%d" % (numClassrooms, numDates)
+        fixture = makeFixture(numClassrooms, numDates)
+        for name, f, prepared in selected:
+          g = f(*fixture) if prepared else lambda: f(*fixture)
+          t, relative, spread, peak = measure(g, options["repeat"])
+          results.setdefault(name, {})[size] = { "seconds": t,
+            "relative": relative, "spread": spread, "peakBytes": peak }
+          ratio = ""
+          if baseline != None and "relative" in baseline.get(name,
+            {}).get(size, {}):
+            b = baseline[name][size]
+            r = relative/max(b["relative"], 1e-9)
+            ratio = "%.2fx" % r
+            noise = noiseFactor*(spread + b["spread"])
+            if r > 1+options["tolerance"] and\
+              relative-b["relative"] > noise and t >= noiseFloor:
+              regressions.append("%s %s" % (name, size))
+              ratio += " !"
+          self.stdout.write("%-24s %12s %12.2f %12.1f %10s" % (name, size,
+            t*1000, peak/1024, ratio))
+    if options["save"] != None:
+      with open(options["save"], "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    if len(regressions) > 0:
+      raise CommandError("slower than baseline: " + ", ".join(regressions))
@@ -0,0 +1,190 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Generates synthetic schools, schedules, programs, classrooms and
+# counts, for load testing.  Objects are inserted in bulk (signals are
+# not sent, so caches are invalidated and the search index is updated
+# explicitly); counts, which are by far the most numerous, bypass the
+# ORM and are inserted as raw rows, using COPY under PostgreSQL.
+# (Under SQLite, a million counts take roughly 25 seconds, most of
+# which goes to generating random values and indexing for search.)
+# Generated names carry a prefix so that synthetic data is easily
+# identified.  Each school has one program per school year; the
+# programs of a school year share that year's schedules round-robin.
+# Counts are generated for every classroom and every event date not in
+# the future, less a random fraction of missing counts.  Participation
+# rates vary by classroom and, for programs that split counts, so does
+# the fraction of participation that is active.
+
+import csv
+import datetime
+import io
+import itertools
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from wrpt import caching, search
+from wrpt.models import Classroom, Count, EventDate, Program, Schedule,\
+  School, defaultSchoolYear
+from wrpt.signals import afterCommit
+
+countColumns = ["program_id", "eventDate_id", "classroom_id", "enrollment",
+  "value", "activeValue", "inactiveValue", "absentees", "comments"]
+
+def chunks (iterable, size):
+  it = iter(iterable)
+  while True:
+    l = list(itertools.islice(it, size))
+    if len(l) == 0: return
+    yield l
+
+def insertCounts (rows):
+  # Inserts counts given as tuples of countColumns values.
+  q = connection.ops.quote_name
+  table = q(Count._meta.db_table)
+  columns = ", ".join(q(c) for c in countColumns)
+  with connection.cursor() as c:
+    if connection.vendor == "postgresql":
+      f = io.StringIO()
+      csv.writer(f).writerows(rows)
+      f.seek(0)
+      # (In CSV format, empty values denote nulls, save in comments.)
+      c.copy_expert(("COPY %s (%s) FROM STDIN WITH (FORMAT csv, " +\
+        "FORCE_NOT_NULL (%s))") % (table, columns, q("comments")), f)
+    else:
+      c.executemany("INSERT INTO %s (%s) VALUES (%s)" % (table, columns,
+        ", ".join(["%s"]*len(countColumns))), rows)
+
+class Command (BaseCommand):
+  help = "Generates synthetic data for load testing."
+  def add_arguments (self, parser):
+    parser.add_argument("--prefix", default="Synthetic",
+      help="name prefix for generated schools and schedules " +\
+      "(default: Synthetic)")
+    parser.add_argument("--schools", type=int, default=10,
+      help="number of schools (default: 10)")
+    parser.add_argument("--years", type=int, default=1,
+      help="number of school years, ending with the current year " +\
+      "(default: 1)")
+    parser.add_argument("--schedules", type=int, default=1,
+      help="number of schedules per school year (default: 1)")
+    parser.add_argument("--dates", type=int, default=30,
+      help="number of event dates per schedule (default: 30)")
+    parser.add_argument("--classrooms", type=int, default=20,
+      help="number of classrooms per program (default: 20)")
+    parser.add_argument("--split", type=float, default=0.5,
+      help="fraction of programs that split counts (default: 0.5)")
+    parser.add_argument("--goal", type=float, default=0.5,
+      help="fraction of programs that have a participation goal " +\
+      "(default: 0.5)")
+    parser.add_argument("--missing", type=float, default=0.1,
+      help="fraction of counts that are missing (default: 0.1)")
+    parser.add_argument("--absentees", type=int, default=3,
+      help="maximum number of absentees per count (default: 3)")
+    parser.add_argument("--seed", type=int,
+      help="random number generator seed")
+    parser.add_argument("--batch-size", type=int, default=5000,
+      help="number of counts inserted at a time (default: 5000)")
+  def handle (self, *args, **options):
+    o = options
+    for a in ["schools", "years", "schedules", "dates", "classrooms",
+      "batch_size"]:
+      if o[a] < 1: raise CommandError("--%s must be positive" %\
+        a.replace("_", "-"))
+    for a in ["split", "goal", "missing"]:
+      if not (0 <= o[a] <= 1):
+        raise CommandError("--%s must be between 0 and 1" % a)
+    if o["absentees"] < 0:
+      raise CommandError("--absentees must be non-negative")
+    prefix = o["prefix"].strip()
+    if School.objects.filter(name__startswith=prefix+" school ").exists() or\
+      Schedule.objects.filter(name__startswith=prefix+" ",
+      name__contains=" schedule ").exists():
+      raise CommandError("synthetic data with prefix '%s' already exists" %\
+        prefix)
+    rng = random.Random(o["seed"])
+    today = datetime.date.today()
+    lastYear = int(defaultSchoolYear()[:4])
+    years = list(range(lastYear-o["years"]+1, lastYear+1))
+    with transaction.atomic():
+      # Schedules and event dates.  Event dates are weekly, starting
+      # in September, on a day of the week that varies by schedule.
+      Schedule.objects.bulk_create([Schedule(name="%s %d-%d schedule %d" %\
+        (prefix, y, y+1, i+1)) for y in years\
+        for i in range(o["schedules"])])
+      schedules = dict((y, list(Schedule.objects.filter(
+        name__startswith="%s %d-%d schedule " % (prefix, y, y+1))\
+        .order_by("pk"))) for y in years)
+      eventDates = []
+      for y in years:
+        for i, s in enumerate(schedules[y]):
+          start = datetime.date(y, 9, 1) + datetime.timedelta(days=i%5)
+          eventDates.extend(EventDate(schedule=s,
+            date=start+datetime.timedelta(weeks=j))\
+            for j in range(o["dates"]))
+      EventDate.objects.bulk_create(eventDates)
+      dates = {} # { schedule ID: [EventDate, ...] }
+      for d in EventDate.objects.filter(schedule__in=[s\
+        for l in schedules.values() for s in l]).order_by("date"):
+        dates.setdefault(d.schedule_id, []).append(d)
+      # Schools, programs and classrooms.
+      School.objects.bulk_create([School(name="%s school %d" % (prefix, i+1))\
+        for i in range(o["schools"])])
+      schools = list(School.objects.filter(
+        name__startswith=prefix+" school ").order_by("pk"))
+      Program.objects.bulk_create([Program(school=s,
+        schoolYear="%d-%d" % (y, y+1),
+        schedule=schedules[y][i%len(schedules[y])],
+        splitCounts=(rng.random() < o["split"]),
+        participationGoal=(rng.randrange(30, 80, 5)\
+        if rng.random() < o["goal"] else None))\
+        for i, s in enumerate(schools) for y in years])
+      programs = list(Program.objects.filter(school__in=schools))
+      Classroom.objects.bulk_create([Classroom(program=p,
+        name="Room %d" % (i+1), enrollment=rng.randint(18, 32))\
+        for p in programs for i in range(o["classrooms"])])
+      programMap = dict((p.pk, p) for p in programs)
+      classrooms = Classroom.objects.filter(program__in=programs)\
+        .order_by("pk")
+      # Counts, generated lazily so that memory usage is bounded by
+      # the batch size.
+      def generate ():
+        for c in classrooms:
+          p = programMap[c.program_id]
+          rate = rng.uniform(0.2, 0.8)
+          activeFraction = rng.uniform(0.5, 0.9)
+          enrollment = c.enrollment
+          for d in dates[p.schedule_id]:
+            if d.date > today: break
+            if rng.random() < o["missing"]: continue
+            if rng.random() < 0.05: enrollment = max(1,
+              enrollment+rng.choice([-1, 1]))
+            absentees = rng.randint(0, min(o["absentees"], enrollment-1))
+            present = enrollment - absentees
+            value = min(present, max(0,
+              round(present*(rate+rng.gauss(0, 0.1)))))
+            if p.splitCounts:
+              activeValue = round(value*activeFraction)
+              inactiveValue = value - activeValue
+            else:
+              activeValue = inactiveValue = None
+            yield (p.pk, d.pk, c.pk, enrollment, value, activeValue,
+              inactiveValue, absentees, "")
+      numCounts = 0
+      for l in chunks(generate(), o["batch_size"]):
+        insertCounts(l)
+        numCounts += len(l)
+      search.reindex(Count.objects.filter(program__in=programs))
+      # As in wrpt.signals, caches are invalidated only once the data
+      # is committed, lest a concurrent request re-cache stale data.
+      afterCommit(caching.invalidateProgramListing)
+      afterCommit(caching.invalidateProgramChoices)
+    self.stdout.write(("Created %d schedules, %d event dates, %d schools, " +\
+      "%d programs, %d classrooms, %d counts.") % (sum(len(l)\
+      for l in schedules.values()), len(eventDates), len(schools),
+      len(programs), len(programs)*o["classrooms"], numCounts))
@@ -0,0 +1,47 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Imports counts from a CSV file in the format of the count dump (see
+# wrpt.importer).  If any row is invalid, all errors are reported and
+# nothing is imported.  Imported counts are logged and audited as
+# operations by the user given by --user.
+
+import csv
+import getpass
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wrpt import audit
+from wrpt.importer import importCounts
+
+class Command (BaseCommand):
+  help = "Imports counts from a CSV file."
+  def add_arguments (self, parser):
+    parser.add_argument("file", help="CSV file")
+    parser.add_argument("--check", action="store_true",
+      help="validate the file without importing it")
+    parser.add_argument("--user", default=getpass.getuser(),
+      help="username to record in the audit log (default: the login name)")
+  def handle (self, *args, **options):
+    try:
+      with open(options["file"], encoding="utf-8-sig", newline="") as f:
+        errors, operations = importCounts(f, commit=not options["check"])
+    except (OSError, UnicodeDecodeError) as e:
+      raise CommandError(str(e))
+    except csv.Error as e:
+      raise CommandError("file is not valid CSV: %s" % e)
+    if len(errors) > 0:
+      for e in errors: self.stderr.write(e)
+      raise CommandError("%d error%s; nothing imported" % (len(errors),
+        "s" if len(errors) != 1 else ""))
+    if options["check"]:
+      self.stdout.write("File is valid: %d counts would be saved." %\
+        len(operations))
+      return
+    if len(operations) > 0:
+      audit.recordBatch(options["user"], None, operations)
+      audit.flush()
+    self.stdout.write("%d counts saved." % len(operations))
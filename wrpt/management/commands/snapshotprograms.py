@@ -0,0 +1,60 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Creates snapshots of concluded programs (see wrpt.snapshots), by
+# default of every concluded program that has classrooms and no
+# snapshot yet, building all the programs' pages.  With --rebuild,
+# the pages of existing snapshots are rebuilt as well (they are
+# otherwise rebuilt as they are requested once obsolete); with
+# --delete, the selected programs' snapshots are deleted instead,
+# returning the programs to being computed on demand.
+
+from django.core.management.base import BaseCommand, CommandError
+from wrpt import caching
+from wrpt.models import Program, ProgramSnapshot
+from wrpt.snapshots import buildSnapshot, deleteSnapshots
+
+class Command (BaseCommand):
+  help = "Creates snapshots of concluded programs."
+  def add_arguments (self, parser):
+    parser.add_argument("program", nargs="*", type=int,
+      help="program ID (default: all concluded programs)")
+    parser.add_argument("--rebuild", action="store_true",
+      help="rebuild the pages of existing snapshots")
+    parser.add_argument("--delete", action="store_true",
+      help="delete snapshots")
+  def handle (self, *args, **options):
+    if options["rebuild"] and options["delete"]:
+      raise CommandError("--rebuild and --delete are mutually exclusive")
+    programs = Program.objects.select_related("school")\
+      .order_by("schoolYear", "school__name")
+    if len(options["program"]) > 0:
+      programs = list(programs.filter(pk__in=options["program"]))
+      missing = set(options["program"]) - set(p.pk for p in programs)
+      if len(missing) > 0:
+        raise CommandError("no such program: %s" %\
+          ", ".join(str(id) for id in sorted(missing)))
+      if not options["delete"]:
+        for p in programs:
+          if p.isCurrent():
+            raise CommandError("program is current: %s" % p)
+    else:
+      programs = [p for p in programs.filter(classroom__isnull=False)\
+        .distinct() if not p.isCurrent()]
+    if options["delete"]:
+      deleteSnapshots(*[p.pk for p in programs])
+      self.stdout.write("Deleted snapshots of %d programs." % len(programs))
+      return
+    existing = set(ProgramSnapshot.objects.filter(program__in=programs)\
+      .values_list("program_id", flat=True))
+    n = 0
+    for p in programs:
+      if p.pk in existing and not options["rebuild"]: continue
+      buildSnapshot(p)
+      caching.bumpProgramVersion(p.pk)
+      self.stdout.write(str(p))
+      n += 1
+    self.stdout.write("Built snapshots of %d programs." % n)
@@ -0,0 +1,172 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Per-view performance metrics.  MetricsMiddleware records, for each
+# request, the latency, the number and total duration of SQL queries,
+# and the template rendering time (as measured by the TimedTemplates
+# backend), in histograms keyed by URL name and HTTP method.  The
+# histograms are kept in-process; since Gunicorn runs several worker
+# processes, each process periodically publishes its histograms to a
+# file of its own in a shared directory (the WRPT_METRICS_DIR
+# setting), and the metrics view sums the files.  Files of processes
+# that have been idle (or gone) for longer than `retention` are
+# removed.  The exposition format is Prometheus's text format, in
+# which all histograms are cumulative counters.
+
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates
+
+publishInterval = 10 # seconds
+retention = 24*60*60 # seconds
+
+timeBuckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+countBuckets = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+# (name, description, buckets)
+metrics = [
+  ("wrpt_request_duration_seconds", "Request latency.", timeBuckets),
+  ("wrpt_request_sql_queries", "SQL queries per request.", countBuckets),
+  ("wrpt_request_sql_duration_seconds", "SQL query time per request.",
+    timeBuckets),
+  ("wrpt_request_template_duration_seconds",
+    "Template rendering time per request.", timeBuckets)
+]
+
+methods = ["GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS"]
+
+_lock = threading.Lock()
+_data = {} # { (metric, view, method): [[bucket count, ...], sum] }
+_local = threading.local()
+_file = "%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8])
+_lastPublished = time.monotonic()
+
+def observe (metric, view, method, value):
+  buckets = next(b for m, _, b in metrics if m == metric)
+  i = next((i for i, b in enumerate(buckets) if value <= b), len(buckets))
+  with _lock:
+    h = _data.setdefault((metric, view, method), [[0]*(len(buckets)+1), 0])
+    h[0][i] += 1
+    h[1] += value
+
+def publish ():
+  # Writes this process's histograms to its file.
+  global _lastPublished
+  with _lock:
+    l = [list(k) + [v[0][:], v[1]] for k, v in _data.items()]
+    _lastPublished = time.monotonic()
+  os.makedirs(settings.WRPT_METRICS_DIR, exist_ok=True)
+  fd, tmp = tempfile.mkstemp(dir=settings.WRPT_METRICS_DIR, suffix=".tmp")
+  with os.fdopen(fd, "w") as f:
+    json.dump(l, f)
+  os.replace(tmp, os.path.join(settings.WRPT_METRICS_DIR, _file))
+
+atexit.register(lambda: len(_data) > 0 and publish())
+
+def collect ():
+  # Returns the histograms of all processes, summed, in the form of
+  # _data.
+  publish()
+  data = {}
+  for path in glob.glob(os.path.join(settings.WRPT_METRICS_DIR, "*.json")):
+    try:
+      if os.stat(path).st_mtime < time.time()-retention:
+        os.remove(path)
+        continue
+      with open(path) as f: l = json.load(f)
+    except (OSError, ValueError):
+      continue
+    for metric, view, method, counts, total in l:
+      h = data.setdefault((metric, view, method), [[0]*len(counts), 0])
+      h[0] = [a+b for a, b in zip(h[0], counts)]
+      h[1] += total
+  return data
+
+def exposition ():
+  # Returns the metrics in Prometheus text format.
+  data = collect()
+  lines = []
+  for metric, description, buckets in metrics:
+    lines.append("# HELP %s %s" % (metric, description))
+    lines.append("# TYPE %s histogram" % metric)
+    for (m, view, method), (counts, total) in sorted(data.items()):
+      if m != metric: continue
+      labels = 'view="%s",method="%s"' % (view.replace("\\", "\\\\")\
+        .replace('"', '\\"'), method)
+      n = 0
+      for b, c in zip(buckets + ["+Inf"], counts):
+        n += c
+        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, b, n))
+      lines.append("%s_sum{%s} %s" % (metric, labels, repr(float(total))))
+      lines.append("%s_count{%s} %d" % (metric, labels, n))
+  return "\n".join(lines) + "\n"
+
+class TimedTemplates (DjangoTemplates):
+  # The Django template backend, timing renderings for the benefit of
+  # MetricsMiddleware.  Renderings nested within renderings (e.g., by
+  # template tags) are not double-counted.
+  def get_template (self, template_name):
+    return TimedTemplate(super().get_template(template_name))
+  def from_string (self, template_code):
+    return TimedTemplate(super().from_string(template_code))
+
+class TimedTemplate (object):
+  def __init__ (self, template):
+    self.template = template
+    self.origin = template.origin
+  def render (self, context=None, request=None):
+    if getattr(_local, "depth", None) == None:
+      return self.template.render(context, request)
+    _local.depth += 1
+    start = time.perf_counter()
+    try:
+      return self.template.render(context, request)
+    finally:
+      _local.depth -= 1
+      if _local.depth == 0: _local.templateTime += time.perf_counter()-start
+
+class MetricsMiddleware (object):
+  def __init__ (self, get_response):
+    self.get_response = get_response
+  def sqlTimer (self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      _local.sqlQueries += 1
+      _local.sqlTime += time.perf_counter()-start
+  def __call__ (self, request):
+    _local.sqlQueries, _local.sqlTime = 0, 0.0
+    _local.depth, _local.templateTime = 0, 0.0
+    start = time.perf_counter()
+    try:
+      with connection.execute_wrapper(self.sqlTimer):
+        response = self.get_response(request)
+    finally:
+      elapsed = time.perf_counter()-start
+      _local.depth = None
+    # N.B.: the work done by streaming responses as they are consumed
+    # (see views.dumpCounts) is not measured.
+    m = request.resolver_match
+    view = (m.view_name if m != None else None) or "unresolved"
+    method = request.method if request.method in methods else "other"
+    observe("wrpt_request_duration_seconds", view, method, elapsed)
+    observe("wrpt_request_sql_queries", view, method, _local.sqlQueries)
+    observe("wrpt_request_sql_duration_seconds", view, method,
+      _local.sqlTime)
+    observe("wrpt_request_template_duration_seconds", view, method,
+      _local.templateTime)
+    if time.monotonic()-_lastPublished > publishInterval: publish()
+    return response
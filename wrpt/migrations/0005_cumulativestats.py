@@ -0,0 +1,32 @@
+# Generated by Django 2.2.26 on 2026-10-17 21:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0004_wrptuser_hidelink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CumulativeStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enrollment', models.IntegerField()),
+                ('presentSum', models.IntegerField()),
+                ('activeSum', models.IntegerField()),
+                ('inactiveSum', models.IntegerField()),
+                ('combinedCumPct', models.IntegerField()),
+                ('activeCumPct', models.IntegerField()),
+                ('inactiveCumPct', models.IntegerField()),
+                ('classroom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wrpt.Classroom')),
+                ('eventDate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wrpt.EventDate')),
+            ],
+            options={
+                'unique_together': {('classroom', 'eventDate')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.26 on 2026-10-17 21:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0005_cumulativestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgramSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now=True)),
+                ('data', models.BinaryField()),
+                ('program', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='wrpt.Program')),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.26 on 2026-10-17 22:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0006_programsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountAudit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('username', models.CharField(max_length=150)),
+                ('remoteAddress', models.CharField(blank=True, max_length=45, verbose_name='Remote address')),
+                ('operation', models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete')], max_length=6)),
+                ('count', models.IntegerField(blank=True, null=True, verbose_name='Count ID')),
+                ('enrollmentBefore', models.IntegerField(blank=True, null=True)),
+                ('enrollmentAfter', models.IntegerField(blank=True, null=True)),
+                ('valueBefore', models.IntegerField(blank=True, null=True)),
+                ('valueAfter', models.IntegerField(blank=True, null=True)),
+                ('activeValueBefore', models.IntegerField(blank=True, null=True)),
+                ('activeValueAfter', models.IntegerField(blank=True, null=True)),
+                ('inactiveValueBefore', models.IntegerField(blank=True, null=True)),
+                ('inactiveValueAfter', models.IntegerField(blank=True, null=True)),
+                ('absenteesBefore', models.IntegerField(blank=True, null=True)),
+                ('absenteesAfter', models.IntegerField(blank=True, null=True)),
+                ('commentsBefore', models.CharField(blank=True, max_length=1000, null=True)),
+                ('commentsAfter', models.CharField(blank=True, max_length=1000, null=True)),
+                ('classroom', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wrpt.Classroom')),
+                ('eventDate', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wrpt.EventDate', verbose_name='Event date')),
+                ('program', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wrpt.Program')),
+            ],
+            options={
+                'ordering': ['-time'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='countaudit',
+            index=models.Index(fields=['program', '-time'], name='wrpt_counta_program_aea924_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='countaudit',
+            index=models.Index(fields=['classroom', '-time'], name='wrpt_counta_classro_5e21fd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='countaudit',
+            index=models.Index(fields=['-time'], name='wrpt_counta_time_778e6e_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Creates the count search index (see wrpt/search.py), which is not
+# a Django model.
+
+from django.db import migrations
+
+def createIndex(apps, schema_editor):
+    from wrpt import search
+    search.createIndex(schema_editor.connection)
+
+
+def dropIndex(apps, schema_editor):
+    from wrpt import search
+    search.dropIndex(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0007_countaudit'),
+    ]
+
+    operations = [
+        migrations.RunPython(createIndex, dropIndex),
+    ]
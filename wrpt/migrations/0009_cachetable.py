@@ -0,0 +1,20 @@
+# Creates the database cache table, if the database cache is
+# configured (see coast_wrpt/settings.py).
+
+from django.core.management import call_command
+from django.db import migrations
+
+def createCacheTable(apps, schema_editor):
+    call_command('createcachetable',
+        database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0008_countsearch'),
+    ]
+
+    operations = [
+        migrations.RunPython(createCacheTable, migrations.RunPython.noop),
+    ]
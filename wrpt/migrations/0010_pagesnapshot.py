@@ -0,0 +1,46 @@
+# Generated by Django 2.2.26 on 2026-10-17 22:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0009_cachetable'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='programsnapshot',
+            name='created',
+        ),
+        migrations.RemoveField(
+            model_name='programsnapshot',
+            name='data',
+        ),
+        migrations.RemoveField(
+            model_name='programsnapshot',
+            name='format',
+        ),
+        migrations.AddField(
+            model_name='programsnapshot',
+            name='generation',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PageSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.CharField(max_length=30)),
+                ('generation', models.IntegerField()),
+                ('format', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now=True)),
+                ('data', models.BinaryField()),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wrpt.ProgramSnapshot')),
+            ],
+            options={
+                'unique_together': {('snapshot', 'page')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.26 on 2026-10-17 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrpt', '0010_pagesnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='countaudit',
+            name='username',
+            field=models.CharField(db_index=True, max_length=150),
+        ),
+    ]
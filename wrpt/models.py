@@ -5,8 +5,12 @@
 # -----------------------------------------------------------------------------
 
 import datetime
+import pickle
 import re
+import zlib
 
+import django
+from django.apps import apps
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -206,10 +210,14 @@ class Count (models.Model):
     # error(s), but at this point in the process the object will not
     # have the corresponding attributes at all, hence the protecting
     # calls to hasattr.
+    # IDs are compared so that no related objects need be fetched
+    # beyond the count's own (cf. wrpt.importer, which validates counts
+    # against preloaded objects).
     if hasattr(self, "eventDate") and\
-      self.eventDate.schedule != self.program.schedule:
+      self.eventDate.schedule_id != self.program.schedule_id:
       raise ValidationError("Event date is not in program's schedule.")
-    if hasattr(self, "classroom") and self.classroom.program != self.program:
+    if hasattr(self, "classroom") and\
+      self.classroom.program_id != self.program_id:
       raise ValidationError("Classroom is not in program.")
     if self.program.splitCounts:
       e = {}
@@ -244,3 +252,123 @@ class Count (models.Model):
       repr(self.comments))
   class Meta:
     unique_together = ("program", "eventDate", "classroom")
+
+class CumulativeStats (models.Model):
+  # Cumulative statistics for a classroom as of an event date, i.e.,
+  # running sums of the classroom's counts through the date.  This is
+  # derived data, maintained by the wrpt.cumulative module; see there
+  # for details.  'enrollment' is the enrollment in effect on the
+  # event date: the count's enrollment if a count was recorded, else
+  # the most recently observed enrollment.
+  classroom = models.ForeignKey(Classroom, on_delete=models.CASCADE)
+  eventDate = models.ForeignKey(EventDate, on_delete=models.CASCADE)
+  enrollment = models.IntegerField()
+  presentSum = models.IntegerField()
+  activeSum = models.IntegerField()
+  inactiveSum = models.IntegerField()
+  combinedCumPct = models.IntegerField()
+  activeCumPct = models.IntegerField()
+  inactiveCumPct = models.IntegerField()
+  class Meta:
+    unique_together = ("classroom", "eventDate")
+
+class ProgramSnapshot (models.Model):
+  # The mark of a concluded program whose pages are served from
+  # snapshots (see PageSnapshot).  'generation' is incremented by any
+  # change to the program's data, obsoleting the snapshots built
+  # before it.  This is derived data, maintained by the wrpt.snapshots
+  # module; see there for details.
+  program = models.OneToOneField(Program, on_delete=models.CASCADE)
+  generation = models.IntegerField(default=0)
+
+class PageSnapshot (models.Model):
+  # The precomputed view data (statistics, rankings and charts) of one
+  # page of a snapshotted program: the program page in one category, or
+  # one classroom's page.  'page' names the page (see wrpt.snapshots),
+  # and 'generation' is the program snapshot's generation from which
+  # the data was computed.  'data' is a pickled dictionary, which holds
+  # model instances among other things; 'format' identifies both the
+  # dictionary's layout (layoutVersion, to be incremented whenever the
+  # layout changes) and the definitions of the models as pickled (see
+  # currentFormat), and snapshots in other than the current format,
+  # or that cannot be unpickled, are disregarded.
+  layoutVersion = 3
+  snapshot = models.ForeignKey(ProgramSnapshot, on_delete=models.CASCADE)
+  page = models.CharField(max_length=30)
+  generation = models.IntegerField()
+  format = models.IntegerField()
+  created = models.DateTimeField(auto_now=True)
+  data = models.BinaryField()
+  class Meta:
+    unique_together = ("snapshot", "page")
+  @staticmethod
+  def currentFormat ():
+    # Returns a hash of the layout version, the Django version, and the
+    # names and types of the fields of the application's models, so
+    # that any change to the models obsoletes existing snapshots.
+    global _snapshotFormat
+    if _snapshotFormat == None:
+      l = [str(PageSnapshot.layoutVersion), django.get_version()]
+      for m in sorted(apps.get_app_config("wrpt").get_models(),
+        key=lambda m: m.__name__):
+        l.append(m.__name__ + ":" + ",".join("%s=%s" % (f.attname,
+          f.get_internal_type()) for f in m._meta.concrete_fields))
+      _snapshotFormat = zlib.crc32(";".join(l).encode()) & 0x7fffffff
+    return _snapshotFormat
+  @staticmethod
+  def loadData (format, data):
+    # Returns snapshot data as stored, or None if the format is
+    # obsolete or the data is otherwise unreadable.
+    if format != PageSnapshot.currentFormat(): return None
+    try:
+      return pickle.loads(data)
+    except Exception:
+      return None
+
+_snapshotFormat = None
+
+class CountAudit (models.Model):
+  # A record of a count's creation, modification or deletion, by
+  # whom, and the count's values before and after.  Records are
+  # written in batches by a background thread (see wrpt.audit).  The
+  # count itself is referenced by ID only, as it may since have been
+  # deleted; references to its program, event date and classroom
+  # likewise survive their deletion as nulls.
+  auditedFields = ["enrollment", "value", "activeValue", "inactiveValue",
+    "absentees", "comments"]
+  time = models.DateTimeField()
+  # Indexed for the admin's username filter, which lists the distinct
+  # usernames.
+  username = models.CharField(max_length=150, db_index=True)
+  remoteAddress = models.CharField(max_length=45, blank=True,
+    verbose_name="Remote address")
+  operation = models.CharField(max_length=6,
+    choices=[("create", "create"), ("update", "update"),
+    ("delete", "delete")])
+  count = models.IntegerField(blank=True, null=True, verbose_name="Count ID")
+  # Lookups by program and classroom are served by the indexes below.
+  program = models.ForeignKey(Program, on_delete=models.SET_NULL,
+    blank=True, null=True, db_index=False)
+  eventDate = models.ForeignKey(EventDate, on_delete=models.SET_NULL,
+    blank=True, null=True, verbose_name="Event date")
+  classroom = models.ForeignKey(Classroom, on_delete=models.SET_NULL,
+    blank=True, null=True, db_index=False)
+  enrollmentBefore = models.IntegerField(blank=True, null=True)
+  enrollmentAfter = models.IntegerField(blank=True, null=True)
+  valueBefore = models.IntegerField(blank=True, null=True)
+  valueAfter = models.IntegerField(blank=True, null=True)
+  activeValueBefore = models.IntegerField(blank=True, null=True)
+  activeValueAfter = models.IntegerField(blank=True, null=True)
+  inactiveValueBefore = models.IntegerField(blank=True, null=True)
+  inactiveValueAfter = models.IntegerField(blank=True, null=True)
+  absenteesBefore = models.IntegerField(blank=True, null=True)
+  absenteesAfter = models.IntegerField(blank=True, null=True)
+  commentsBefore = models.CharField(max_length=1000, blank=True, null=True)
+  commentsAfter = models.CharField(max_length=1000, blank=True, null=True)
+  def __str__ (self):
+    return "%s %s %s" % (self.time, self.username, self.operation)
+  class Meta:
+    ordering = ["-time"]
+    indexes = [models.Index(fields=["program", "-time"]),
+      models.Index(fields=["classroom", "-time"]),
+      models.Index(fields=["-time"])]
@@ -0,0 +1,117 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# On-demand profiling.  A staff member can append a 'profile' query
+# parameter to any URL to have the request processed under cProfile
+# and tracemalloc, with SQL queries captured, and receive a plain text
+# report in place of the response:
+#
+#   ?profile             report, functions sorted by cumulative time
+#   ?profile=tottime     report, functions sorted by internal time
+#                        (any pstats sort key may be given)
+#   ?profile=save        also save the report, and the raw profile
+#                        data (for use with pstats), in the
+#                        WRPT_PROFILE_DIR directory
+#
+# Sort key and "save" may be combined, e.g., ?profile=tottime,save.
+# Cached pages are bypassed (see caching.cachedPage) so that the view
+# actually does its work; values cached by the view itself are not.
+#
+# tracemalloc does not track peak memory per allocation site, so the
+# report gives the overall peak, plus the allocation sites of the
+# memory allocated during the request that remains allocated at its
+# end (which includes the response).
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+maximumFunctions = 40
+maximumAllocationSites = 25
+
+class ProfilingMiddleware (object):
+  # Must follow AuthenticationMiddleware.
+  def __init__ (self, get_response):
+    self.get_response = get_response
+  def __call__ (self, request):
+    if "profile" not in request.GET or not request.user.is_staff:
+      return self.get_response(request)
+    options = request.GET["profile"].split(",")
+    sortKey = next((o for o in options if o not in ["", "save"]),
+      "cumulative")
+    if sortKey not in pstats.Stats.sort_arg_dict_default:
+      return HttpResponse("Invalid profile sort key: %s\n" % sortKey,
+        content_type="text/plain", status=400)
+    request.wrptProfiling = True
+    queries = []
+    def sqlTimer (execute, sql, params, many, context):
+      start = time.perf_counter()
+      try:
+        return execute(sql, params, many, context)
+      finally:
+        queries.append((time.perf_counter()-start, sql, params))
+    profile = cProfile.Profile()
+    tracemalloc.start(10)
+    try:
+      before = tracemalloc.take_snapshot()
+      start = time.perf_counter()
+      with connection.execute_wrapper(sqlTimer):
+        profile.enable()
+        try:
+          response = self.get_response(request)
+          # Streaming responses do their work as they are consumed.
+          if response.streaming:
+            size = sum(len(b) for b in response.streaming_content)
+          else:
+            size = len(response.content)
+        finally:
+          profile.disable()
+      elapsed = time.perf_counter()-start
+      _, peak = tracemalloc.get_traced_memory()
+      after = tracemalloc.take_snapshot()
+    finally:
+      tracemalloc.stop()
+    f = io.StringIO()
+    f.write("%s %s\n" % (request.method, request.get_full_path()))
+    f.write("Status %d, %d bytes, %.1f ms, %s\n" % (response.status_code,
+      size, elapsed*1000, datetime.datetime.now().isoformat(" ", "seconds")))
+    f.write("\n=== Functions (by %s) ===\n\n" % sortKey)
+    stats = pstats.Stats(profile, stream=f)
+    stats.sort_stats(sortKey).print_stats(maximumFunctions)
+    f.write("=== Memory ===\n\nPeak traced: %.1f KiB\n" % (peak/1024))
+    f.write("Allocated during the request and still held at its end," +\
+      " by site:\n\n")
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    for s in after.filter_traces(filters).compare_to(
+      before.filter_traces(filters), "lineno")[:maximumAllocationSites]:
+      if s.size_diff <= 0: break
+      frame = s.traceback[0]
+      f.write("%10.1f KiB %8d blocks  %s:%d\n" % (s.size_diff/1024,
+        s.count_diff, frame.filename, frame.lineno))
+    f.write("\n=== SQL (%d queries, %.1f ms) ===\n\n" % (len(queries),
+      sum(q[0] for q in queries)*1000))
+    for t, sql, params in queries:
+      f.write("%8.2f ms  %s\n" % (t*1000, sql))
+      if params: f.write("%12s%r\n" % ("", params))
+    report = f.getvalue()
+    if "save" in options:
+      os.makedirs(settings.WRPT_PROFILE_DIR, exist_ok=True)
+      name = "%s-%s" % (datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+        re.sub(r"[^\w]+", "_", request.path).strip("_") or "home")
+      path = os.path.join(settings.WRPT_PROFILE_DIR, name)
+      stats.dump_stats(path + ".prof")
+      with open(path + ".txt", "w") as g: g.write(report)
+      report = "Saved as %s.{txt,prof}\n\n" % path + report
+    return HttpResponse(report, content_type="text/plain; charset=utf-8")
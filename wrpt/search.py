@@ -0,0 +1,147 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Full-text search over counts.  Each count is indexed by a document
+# comprising its comments, its program's school year and school name,
+# and its classroom name.  The index is a table outside the Django
+# models (created by migration 0008), whose form depends on the
+# database:
+#
+#   PostgreSQL: wrpt_countsearch (count_id, document), where document
+#     is a tsvector (English configuration) with a GIN index, and
+#     count_id references the count (so rows are deleted with counts)
+#   SQLite: an FTS5 virtual table wrpt_countsearch (document), whose
+#     rowid is the count ID, using the Porter stemmer
+#
+# Each word of a search term matches any indexed word it is a prefix
+# of (after stemming), so that, e.g., "wash" finds "Washington" and
+# "rm 1" finds "Rm 12".  On other databases there is no index and
+# searches fall back to case-insensitive substring matching.  The index is kept in sync by
+# the receivers in wrpt.signals; code that modifies counts in bulk
+# must call reindex itself (as countsChanged does).  Since bulk
+# deletions on SQLite can leave rows for deleted counts in the index,
+# searches always join back to the counts.
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from wrpt.models import Count
+
+indexTable = "wrpt_countsearch"
+
+def available (connection=connection):
+  return connection.vendor in ["postgresql", "sqlite"]
+
+def keyColumn (connection=connection):
+  return "count_id" if connection.vendor == "postgresql" else "rowid"
+
+def createIndex (connection):
+  # Creates and populates the index.  For use by migrations.
+  if not available(connection): return
+  with connection.cursor() as c:
+    if connection.vendor == "postgresql":
+      c.execute(("CREATE TABLE %s (count_id integer PRIMARY KEY " +\
+        "REFERENCES %s (id) ON DELETE CASCADE DEFERRABLE INITIALLY " +\
+        "DEFERRED, document tsvector NOT NULL)") % (indexTable,
+        connection.ops.quote_name("wrpt_count")))
+      c.execute("CREATE INDEX %s_document ON %s USING GIN (document)" %\
+        (indexTable, indexTable))
+    else:
+      c.execute(("CREATE VIRTUAL TABLE %s USING fts5(document, " +\
+        "tokenize='porter unicode61')") % indexTable)
+  reindex(connection=connection)
+
+def dropIndex (connection):
+  if not available(connection): return
+  with connection.cursor() as c:
+    c.execute("DROP TABLE %s" % indexTable)
+
+def reindex (counts=None, connection=connection):
+  # (Re)indexes the counts in a Count queryset, or all counts.
+  if not available(connection): return
+  q = connection.ops.quote_name
+  document = ("c.%s || ' ' || p.%s || ' ' || s.%s || ' ' || r.%s") %\
+    (q("comments"), q("schoolYear"), q("name"), q("name"))
+  if connection.vendor == "postgresql":
+    document = "to_tsvector('english', %s)" % document
+  if counts == None:
+    where, params = "", []
+  else:
+    sql, params = counts.values("pk").query.sql_with_params()
+    where = "WHERE c.id IN (%s)" % sql
+  with connection.cursor() as c:
+    if counts == None:
+      c.execute("DELETE FROM %s" % indexTable)
+    else:
+      c.execute("DELETE FROM %s WHERE %s IN (%s)" % (indexTable,
+        keyColumn(connection), sql), params)
+    c.execute(("INSERT INTO %s (%s, document) SELECT c.id, %s " +\
+      "FROM %s c JOIN %s p ON p.id = c.%s JOIN %s s ON s.id = p.%s " +\
+      "JOIN %s r ON r.id = c.%s %s") % (indexTable, keyColumn(connection),
+      document, q("wrpt_count"), q("wrpt_program"), q("program_id"),
+      q("wrpt_school"), q("school_id"), q("wrpt_classroom"),
+      q("classroom_id"), where), params)
+
+def unindex (*countIds):
+  if not available() or len(countIds) == 0: return
+  with connection.cursor() as c:
+    c.execute("DELETE FROM %s WHERE %s IN (%s)" % (indexTable, keyColumn(),
+      ", ".join(["%s"]*len(countIds))), countIds)
+
+def matchQuery (term):
+  # Returns (SQL condition on the index table, parameter), or None if
+  # the term contains no words.  Words are quoted so that query syntax
+  # is not interpreted, and are matched as prefixes.
+  words = re.findall(r"\w+", term)
+  if len(words) == 0: return None
+  if connection.vendor == "postgresql":
+    return "document @@ to_tsquery('english', %s)",\
+      " & ".join("'%s':*" % w for w in words)
+  else:
+    return "%s MATCH %%s" % indexTable, " ".join('"%s"*' % w for w in words)
+
+def filterCounts (queryset, term):
+  # Filters a Count queryset to the counts matching a search term.
+  if not available():
+    q = Q()
+    for w in term.split():
+      q &= Q(comments__icontains=w) | Q(program__schoolYear__icontains=w) |\
+        Q(program__school__name__icontains=w) |\
+        Q(classroom__name__icontains=w)
+    return queryset.filter(q)
+  m = matchQuery(term)
+  if m == None: return queryset.none()
+  # (A RawSQL subquery can't be used with pk__in, as Django
+  # parenthesizes it twice, which SQLite takes as a scalar subquery.)
+  return queryset.extra(where=["%s.id IN (SELECT %s FROM %s WHERE %s)" %\
+    (connection.ops.quote_name(Count._meta.db_table), keyColumn(),
+    indexTable, m[0])], params=[m[1]])
+
+def searchCounts (term, limit):
+  # Returns up to `limit` counts matching a search term, most relevant
+  # first (or, lacking an index, most recent first).
+  counts = Count.objects.select_related("program__school", "eventDate",
+    "classroom")
+  if not available():
+    return list(filterCounts(counts, term)\
+      .order_by("-eventDate__date")[:limit])
+  m = matchQuery(term)
+  if m == None: return []
+  if connection.vendor == "postgresql":
+    rank = "ts_rank(document, to_tsquery('english', %s)) DESC"
+    params = [m[1], m[1]]
+  else:
+    rank = "bm25(%s)" % indexTable
+    params = [m[1]]
+  with connection.cursor() as c:
+    # The limit is doubled to allow for rows of deleted counts.
+    c.execute("SELECT %s FROM %s WHERE %s ORDER BY %s LIMIT %%s" %\
+      (keyColumn(), indexTable, m[0], rank), params + [2*limit])
+    ids = [r[0] for r in c.fetchall()]
+  map = counts.in_bulk(ids)
+  return [map[id] for id in ids if id in map][:limit]
@@ -0,0 +1,198 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Signal receivers that keep cached and derived data consistent with
+# the database.  Note that signals are not sent by bulk operations
+# (QuerySet.update, bulk_create, etc.); code performing such
+# operations must perform the equivalent invalidations itself.
+#
+# Cache invalidations are deferred until the enclosing transaction (if
+# any) commits; otherwise, a concurrent request could re-cache stale
+# data in the interim.  Derived data in the database (cumulative
+# statistics, the search index and snapshots) is invalidated within
+# the transaction.
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from wrpt import caching, cumulative, search, snapshots
+from wrpt.models import Classroom, Count, EventDate, Program, School
+
+def afterCommit (f, *args):
+  transaction.on_commit(lambda: f(*args))
+
+def countsChanged (programId, classroomIds, fromDate):
+  # Performs the equivalent of the invalidations below for counts
+  # created, modified or deleted in bulk, in the given program and
+  # classrooms, on or after the given date.  Cumulative statistics
+  # are discarded rather than recomputed; they will be recomputed, in
+  # bulk, when next read.
+  cumulative.discardCumulativeStats(classroom_id__in=classroomIds,
+    eventDate__date__gte=fromDate)
+  search.reindex(Count.objects.filter(classroom_id__in=classroomIds,
+    eventDate__date__gte=fromDate))
+  snapshots.invalidateSnapshots(programId)
+  afterCommit(caching.bumpProgramVersion, programId)
+
+def classroomsChanged (programId, updatedClassroomIds):
+  # Performs the equivalent of the invalidations below for classrooms
+  # created or modified in bulk in the given program.  (Modified
+  # classrooms are assumed not to have been renamed.)
+  cumulative.discardCumulativeStats(classroom_id__in=updatedClassroomIds)
+  snapshots.invalidateSnapshots(programId)
+  afterCommit(caching.invalidateProgramListing)
+  afterCommit(caching.bumpProgramVersion, programId)
+
+def eventDatesChanged (scheduleId):
+  # Performs the equivalent of the invalidations below for event dates
+  # created or modified in bulk in the given schedule.
+  programIds = list(Program.objects.filter(schedule_id=scheduleId)\
+    .values_list("pk", flat=True))
+  cumulative.discardCumulativeStats(
+    classroom__program__schedule_id=scheduleId)
+  snapshots.invalidateSnapshots(*programIds)
+  afterCommit(caching.bumpProgramVersion, *programIds)
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+@receiver(post_save, sender=Program)
+@receiver(post_delete, sender=Program)
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def programListingChanged (sender, **kwargs):
+  # The home page listing displays program names (which incorporate
+  # school names) and depends on which programs have classrooms.
+  afterCommit(caching.invalidateProgramListing)
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+@receiver(post_save, sender=Program)
+@receiver(post_delete, sender=Program)
+def programChoicesChanged (sender, **kwargs):
+  afterCommit(caching.invalidateProgramChoices)
+
+# (Counts bump their programs' versions in countChanged below.)
+
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def programDataChanged (sender, instance, **kwargs):
+  afterCommit(caching.bumpProgramVersion, instance.program_id)
+
+@receiver(post_save, sender=Program)
+def programVersionChanged (sender, instance, **kwargs):
+  afterCommit(caching.bumpProgramVersion, instance.pk)
+
+@receiver(post_save, sender=School)
+def schoolChanged (sender, instance, **kwargs):
+  # Program pages display the school name.
+  afterCommit(caching.bumpProgramVersion,
+    *Program.objects.filter(school=instance).values_list("pk", flat=True))
+
+@receiver(post_save, sender=EventDate)
+@receiver(post_delete, sender=EventDate)
+def scheduleChanged (sender, instance, **kwargs):
+  afterCommit(caching.bumpProgramVersion, *Program.objects\
+    .filter(schedule_id=instance.schedule_id).values_list("pk", flat=True))
+
+@receiver(pre_save, sender=Count)
+def countChanging (sender, instance, raw=False, **kwargs):
+  # A count's event date and classroom can be changed (in the admin),
+  # in which case the cumulative statistics for the original classroom
+  # and date must be refreshed as well.
+  if instance.pk != None and not raw:
+    instance._wrptOriginal = Count.objects.filter(pk=instance.pk)\
+      .values_list("classroom_id", "eventDate__date").first()
+
+@receiver(post_save, sender=Count)
+@receiver(post_delete, sender=Count)
+def countChanged (sender, instance, **kwargs):
+  try:
+    date = instance.eventDate.date
+  except EventDate.DoesNotExist:
+    date = None
+  l = [(instance.classroom_id, date)]
+  original = getattr(instance, "_wrptOriginal", None)
+  if original != None and original != l[0]: l.append(original)
+  # The refresh is deferred until the transaction commits, by which
+  # time a cascading deletion of the classroom will have completed.
+  # The program's version is bumped only after the refresh; bumped
+  # first, a page requested in the interim would be rendered from
+  # stale statistics and cached under the new version.
+  programId = instance.program_id
+  def refresh ():
+    try:
+      for classroomId, date in l:
+        cumulative.refreshCumulativeStats(classroomId, date)
+    finally:
+      caching.bumpProgramVersion(programId)
+  transaction.on_commit(refresh)
+
+@receiver(post_save, sender=Classroom)
+def classroomChanged (sender, instance, created=False, **kwargs):
+  # The classroom's nominal enrollment figures in its statistics.
+  if not created: cumulative.discardCumulativeStats(classroom=instance)
+
+@receiver(post_save, sender=Program)
+def programChanged (sender, instance, created=False, **kwargs):
+  # The program's schedule may have changed.
+  if not created:
+    cumulative.discardCumulativeStats(classroom__program=instance)
+
+@receiver(post_save, sender=EventDate)
+@receiver(post_delete, sender=EventDate)
+def eventDateChanged (sender, instance, **kwargs):
+  cumulative.discardCumulativeStats(
+    classroom__program__schedule_id=instance.schedule_id)
+
+# Program snapshots (see wrpt.snapshots) are invalidated whenever the
+# data they derive from changes.
+
+@receiver(post_save, sender=Count)
+@receiver(post_delete, sender=Count)
+@receiver(post_save, sender=Classroom)
+@receiver(post_delete, sender=Classroom)
+def snapshotDataChanged (sender, instance, **kwargs):
+  snapshots.invalidateSnapshots(instance.program_id)
+
+@receiver(post_save, sender=Program)
+def snapshotProgramChanged (sender, instance, **kwargs):
+  snapshots.invalidateSnapshots(instance.pk)
+
+@receiver(post_save, sender=School)
+def snapshotSchoolChanged (sender, instance, **kwargs):
+  snapshots.invalidateSnapshots(*Program.objects.filter(school=instance)\
+    .values_list("pk", flat=True))
+
+@receiver(post_save, sender=EventDate)
+@receiver(post_delete, sender=EventDate)
+def snapshotScheduleChanged (sender, instance, **kwargs):
+  snapshots.invalidateSnapshots(*Program.objects\
+    .filter(schedule_id=instance.schedule_id).values_list("pk", flat=True))
+
+# The count search index (see wrpt.search) incorporates program,
+# school and classroom names.
+
+@receiver(post_save, sender=Count)
+def countSearchChanged (sender, instance, **kwargs):
+  search.reindex(Count.objects.filter(pk=instance.pk))
+
+@receiver(post_delete, sender=Count)
+def countSearchDeleted (sender, instance, **kwargs):
+  search.unindex(instance.pk)
+
+@receiver(post_save, sender=School)
+def schoolSearchChanged (sender, instance, created=False, **kwargs):
+  if not created:
+    search.reindex(Count.objects.filter(program__school=instance))
+
+@receiver(post_save, sender=Program)
+def programSearchChanged (sender, instance, created=False, **kwargs):
+  if not created: search.reindex(Count.objects.filter(program=instance))
+
+@receiver(post_save, sender=Classroom)
+def classroomSearchChanged (sender, instance, created=False, **kwargs):
+  if not created: search.reindex(Count.objects.filter(classroom=instance))
@@ -0,0 +1,198 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Snapshots of concluded programs.  Once a program has concluded its
+# data rarely changes, yet its pages would otherwise be recomputed
+# whenever the cache is cleared.  A concluded program marked as
+# snapshotted (by a ProgramSnapshot, created by the snapshotprograms
+# management command) has its pages served from page snapshots, each
+# holding everything the program or classroom view computes for one
+# page (statistics, rankings, standings and rendered charts).  Each
+# page is stored separately, so that a request loads only the data
+# of the page it serves.  Programs without snapshots are unaffected.
+#
+# Page snapshots are built on demand: a view finding no usable
+# snapshot of its page computes the page and saves the result, and
+# the snapshotprograms command builds all of a program's pages in
+# advance.  Any change to a snapshotted program's data increments the
+# program snapshot's generation (see invalidateSnapshots, called by
+# the receivers in wrpt.signals in the changing transaction), and page
+# snapshots of earlier generations are disregarded.  A page snapshot
+# records the generation read before its data was computed, so that
+# data computed concurrently with a change is disregarded as well.
+#
+# Pages are named "program <category>", where the categories are as
+# returned by views.categoryAttributes, and "classroom <classroom
+# ID>".  Page snapshot data is a dictionary:
+#
+#   program page: context
+#   classroom page: { "dates": [EventDate, ...], "counts": [Count, ...],
+#     "context": context }
+#
+# where program contexts hold the values added by views.addProgramData,
+# addProgramGraphs and addCharts (less the counts referenced by the
+# classroom statistics), and classroom contexts hold the
+# values added by views.addClassroomData, addClassroomGraphs and
+# addCharts, plus the classroom label.  The classroom dates and counts
+# are as loaded by loaders.ClassroomDataLoader.  The statistics are
+# computed directly from the counts, bypassing the cumulative
+# statistics table, which may be awaiting a refresh.  As model
+# instances are pickled, page snapshots are obsoleted by any change to
+# the models (see PageSnapshot.currentFormat), and are then rebuilt
+# as their pages are requested.
+
+import datetime
+import pickle
+
+from django.db import IntegrityError, models, transaction
+
+from wrpt import caching
+from wrpt.models import Classroom, Count, EventDate, PageSnapshot,\
+  ProgramSnapshot
+
+def programPageName (category):
+  return "program " + category
+
+def classroomPageName (classroomId):
+  return "classroom %d" % classroomId
+
+def loadPage (program, page):
+  # Returns (data, generation) for a page of a program.  If the
+  # program is concluded and snapshotted, `generation` is the program
+  # snapshot's (ID, generation), to be passed to savePage, and `data`
+  # is the page's snapshot data, or None if it has no usable snapshot.
+  # Otherwise, both are None.  One query is issued either way.
+  if program.isCurrent(): return None, None
+  s = ProgramSnapshot.objects.filter(program=program)\
+    .annotate(page=models.FilteredRelation("pagesnapshot",
+    condition=models.Q(pagesnapshot__page=page)))\
+    .values_list("pk", "generation", "page__generation", "page__format",
+    "page__data").first()
+  if s == None: return None, None
+  id, generation, pageGeneration, format, data = s
+  if pageGeneration == generation:
+    return PageSnapshot.loadData(format, bytes(data)), (id, generation)
+  else:
+    return None, (id, generation)
+
+def savePage (generation, page, data):
+  # Saves a page's snapshot data, computed from the program snapshot
+  # generation returned by loadPage.
+  id, generation = generation
+  try:
+    with transaction.atomic():
+      PageSnapshot.objects.update_or_create(snapshot_id=id, page=page,
+        defaults={ "generation": generation,
+        "format": PageSnapshot.currentFormat(),
+        "data": pickle.dumps(data, pickle.HIGHEST_PROTOCOL) })
+  except IntegrityError:
+    # Saved concurrently, or the program snapshot was deleted.
+    pass
+
+def computeProgramPage (program, classrooms, category, cumAttr, dates=None,
+  counts=None):
+  # Computes the data of a program page.  `dates` and `counts`, if
+  # supplied, are the program's event dates and counts.
+  from wrpt import views # circular dependency
+  if dates == None:
+    dates = list(EventDate.objects.filter(schedule=program.schedule_id)\
+      .order_by("date"))
+  if counts == None:
+    counts = Count.objects.filter(program=program)
+  map = dict(((c.classroom_id, c.eventDate_id), c) for c in counts)
+  context = { "program": program, "category": category }
+  context["hasData"] = (len(map) > 0)
+  if context["hasData"]:
+    views.addProgramStats(context, dates, map, classrooms,
+      datetime.date.today(), cumAttr)
+    views.addProgramGraphs(context, cumAttr)
+    views.addCharts(context)
+    # The program page does not display individual counts, which would
+    # otherwise make up most of the snapshot.
+    for _, _, l in context["classroomData"]:
+      for s in l: s.__dict__.pop("count", None)
+  return dict((k, v) for k, v in context.items()\
+    if k not in ["program", "category"])
+
+def computeClassroomPage (classroom, dates=None, counts=None, label=None):
+  # Computes the data of a classroom page.  `dates`, `counts` and
+  # `label`, if supplied, are as loaded by loaders.ClassroomDataLoader
+  # and returned by views.classroomLabel.
+  from wrpt import views # circular dependency
+  if dates == None:
+    dates = list(EventDate.objects\
+      .filter(schedule=classroom.program.schedule_id).order_by("date"))
+  if counts == None:
+    counts = list(Count.objects.filter(classroom=classroom)\
+      .select_related("eventDate").order_by("eventDate__date"))
+  context = { "classroom": classroom, "program": classroom.program }
+  context["label"] = label or views.classroomLabel(classroom)
+  context["hasData"] = (len(counts) > 0)
+  if context["hasData"]:
+    views.addClassroomStats(context, classroom, dates,
+      dict(((classroom.pk, c.eventDate_id), c) for c in counts),
+      datetime.date.today())
+    views.addClassroomGraphs(context, classroom)
+    views.addCharts(context)
+  return { "dates": dates, "counts": counts,
+    "context": dict((k, v) for k, v in context.items()\
+    if k not in ["classroom", "program"]) }
+
+def programPage (program, classrooms, category, cumAttr):
+  # Returns the data of a program page if the program is snapshotted,
+  # computing and saving it if need be, or None otherwise.
+  data, generation = loadPage(program, programPageName(category))
+  if data == None and generation != None:
+    data = computeProgramPage(program, classrooms, category, cumAttr)
+    savePage(generation, programPageName(category), data)
+  return data
+
+def classroomPage (classroom):
+  # Likewise, for a classroom page.
+  data, generation = loadPage(classroom.program,
+    classroomPageName(classroom.pk))
+  if data == None and generation != None:
+    data = computeClassroomPage(classroom)
+    savePage(generation, classroomPageName(classroom.pk), data)
+  return data
+
+def buildSnapshot (program):
+  # Snapshots a concluded program, building all its pages.
+  from wrpt import views # circular dependency
+  assert not program.isCurrent()
+  with transaction.atomic():
+    s, _ = ProgramSnapshot.objects.get_or_create(program=program)
+  generation = (s.pk, s.generation)
+  classrooms = list(Classroom.objects.filter(program=program)\
+    .select_related("program", "program__school").order_by("name"))
+  dates = list(EventDate.objects.filter(schedule=program.schedule_id)\
+    .order_by("date"))
+  counts = list(Count.objects.filter(program=program)\
+    .select_related("classroom", "eventDate").order_by("eventDate__date"))
+  for code in [None, "a", "i"]:
+    category, _, cumAttr = views.categoryAttributes(code)
+    savePage(generation, programPageName(category),
+      computeProgramPage(program, classrooms, category, cumAttr, dates,
+      counts))
+  for classroom in classrooms:
+    if classroom.name == "entire school" and len(classrooms) == 1:
+      label = "school"
+    else:
+      label = "classroom"
+    savePage(generation, classroomPageName(classroom.pk),
+      computeClassroomPage(classroom, dates,
+      [c for c in counts if c.classroom_id == classroom.pk], label))
+
+def invalidateSnapshots (*programIds):
+  # Obsoletes the page snapshots of those of the given programs that
+  # are snapshotted.  To be called in the transaction changing the
+  # programs' data.
+  ProgramSnapshot.objects.filter(program__in=programIds)\
+    .update(generation=models.F("generation")+1)
+
+def deleteSnapshots (*programIds):
+  ProgramSnapshot.objects.filter(program__in=programIds).delete()
+  caching.bumpProgramVersion(*programIds)
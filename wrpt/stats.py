@@ -0,0 +1,286 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Participation statistics.  Program statistics can be computed by
+# any of three engines, selected by the WRPT_PROGRAM_STATS_ENGINE
+# setting: "python" (the default), which accumulates ClassroomStats
+# objects one at a time; "numpy", which computes the statistics for
+# all classrooms and dates at once using NumPy arrays; or "sql", which
+# obtains classrooms' cumulative sums from the database using window
+# functions (see wrpt.aggregates.windowCumulativeStats).  The engines
+# produce identical results (see the parity tests in wrpt.tests).
+
+from django.conf import settings
+from django.db import connection
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from wrpt.models import Count
+
+def percentage (n, d):
+  # Returns n/d as an integer percentage, safely.
+  if d > 0:
+    return round((n/d)*100)
+  else:
+    return 0
+
+class ClassroomStats (object):
+  # This class is more complex than would seem to be necessary because
+  # of the need to accommodate three cases: a date for which there is
+  # a count; a date for which no count was recorded (in which case
+  # percentages are not displayed in the table, but cumulative counts
+  # and percentages are still computed and displayed in the graph);
+  # and a date in the future (which holds no data and serves only as a
+  # placeholder).  Note that the supplied count is stored and may be
+  # modified.  Cumulative sums and percentages are normally
+  # accumulated from the previous ClassroomStats, but may instead be
+  # taken from a precomputed CumulativeStats object.
+  def __init__ (self, date, count=None, prev=None,
+    computeEventDatePercentages=True, cumulative=None):
+    self.date = date
+    if count == None: return
+    self.count = count
+    if count.activeValue == None:
+      count.activeValue = count.value
+      count.inactiveValue = 0
+    present = count.enrollment - count.absentees
+    if cumulative != None:
+      self.presentSum = cumulative.presentSum
+      self.activeSum = cumulative.activeSum
+      self.inactiveSum = cumulative.inactiveSum
+      self.combinedCumPct = cumulative.combinedCumPct
+      self.activeCumPct = cumulative.activeCumPct
+      self.inactiveCumPct = cumulative.inactiveCumPct
+    else:
+      self.presentSum = present
+      self.activeSum = count.activeValue
+      self.inactiveSum = count.inactiveValue
+      if prev != None:
+        self.presentSum += prev.presentSum
+        self.activeSum += prev.activeSum
+        self.inactiveSum += prev.inactiveSum
+      self.combinedCumPct = percentage(self.activeSum+self.inactiveSum,
+        self.presentSum)
+      self.activeCumPct = percentage(self.activeSum, self.presentSum)
+      self.inactiveCumPct = percentage(self.inactiveSum, self.presentSum)
+    if computeEventDatePercentages:
+      self.combinedPct = percentage(count.value, present)
+      self.activePct = percentage(count.activeValue, present)
+      self.inactivePct = percentage(count.inactiveValue, present)
+
+class ProgramStats (object):
+  # Simpler than the preceding, there are only two cases: a date for
+  # which there are percentages (for the event day and cumulative);
+  # and a date in the future (which holds no data and serves only as a
+  # placeholder).
+  def __init__ (self, date, combinedPct=None, activePct=None,
+    inactivePct=None, combinedCumPct=None, activeCumPct=None,
+    inactiveCumPct=None):
+    self.date = date
+    if combinedPct != None:
+      self.combinedPct = combinedPct
+      self.activePct = activePct
+      self.inactivePct = inactivePct
+      self.combinedCumPct = combinedCumPct
+      self.activeCumPct = activeCumPct
+      self.inactiveCumPct = inactiveCumPct
+
+def computeClassroomData (dates, map, classroom, today, cumulative=None):
+  # Returns ([ClassroomStats, ...], lastIndex).  A ClassroomStats
+  # object is returned for each date; those after `today` are empty
+  # placeholders.  `lastIndex` is the index of the last non-empty
+  # ClassroomStats, or -1 if they're all empty.  If supplied,
+  # `cumulative` is a dictionary mapping event date IDs to the
+  # classroom's precomputed CumulativeStats, which must cover every
+  # date not after `today`.
+  stats = []
+  lastEnrollment = classroom.enrollment
+  i = -1
+  for d in dates:
+    if d.date <= today:
+      i += 1
+      # If the classroom has no count recorded for the event date, it
+      # is penalized by being given zero participation relative to its
+      # most recently observed enrollment.
+      if (classroom.pk, d.pk) in map:
+        c = map[(classroom.pk, d.pk)]
+        lastEnrollment = c.enrollment
+        countFound = True
+      else:
+        c = Count(enrollment=lastEnrollment, value=0)
+        countFound = False
+      s = ClassroomStats(d, c, stats[-1] if len(stats) > 0 else None,
+        computeEventDatePercentages=countFound,
+        cumulative=cumulative[d.pk] if cumulative != None else None)
+    else:
+      s = ClassroomStats(d)
+    stats.append(s)
+  return stats, i
+
+def rank (classroomDataTuple, cumAttr):
+  return getattr(classroomDataTuple[1], cumAttr)
+
+def sqlEngineAvailable ():
+  # The SQL engine is supported on PostgreSQL only.
+  return connection.vendor == "postgresql"
+
+def programStatsEngine ():
+  # Returns the name of the program statistics engine in effect,
+  # falling back to the Python engine if NumPy is not installed or if
+  # the database does not support the SQL engine.
+  engine = getattr(settings, "WRPT_PROGRAM_STATS_ENGINE", "python")
+  if engine == "numpy" and numpy == None: engine = "python"
+  if engine == "sql" and not sqlEngineAvailable(): engine = "python"
+  return engine
+
+def computeProgramData (dates, map, classrooms, today, cumAttr,
+  cumulative=None):
+  # Returns (classroomData, [ProgramStats, ...], lastIndex, ranked).
+  # `classroomData` is [(classroom, lastStats, [ClassroomStats, ...]),
+  # ...] in the order of `classrooms`; `lastStats` is the classroom's
+  # last non-empty ClassroomStats or None.  A ProgramStats object is
+  # returned for each date, and `lastIndex` is as in
+  # computeClassroomData.  `ranked` holds the classroomData entries
+  # having a positive cumulative percentage in the category denoted by
+  # `cumAttr`, in descending order of same.  If supplied, `cumulative`
+  # maps classroom IDs to CumulativeStats dictionaries (see
+  # computeClassroomData).
+  cdata = []
+  lastIndex = -1
+  for c in classrooms:
+    # N.B.: the last index will be the same for every classroom and
+    # the program generally.
+    l, lastIndex = computeClassroomData(dates, map, c, today,
+      cumulative[c.pk] if cumulative != None else None)
+    cdata.append((c, l[lastIndex] if lastIndex >= 0 else None, l))
+  data = []
+  for i, d in enumerate(dates):
+    if i <= lastIndex:
+      asum = isum = psum = acsum = icsum = pcsum = 0
+      for _, _, l in cdata:
+        asum += l[i].count.activeValue
+        isum += l[i].count.inactiveValue
+        psum += l[i].count.enrollment - l[i].count.absentees
+        acsum += l[i].activeSum
+        icsum += l[i].inactiveSum
+        pcsum += l[i].presentSum
+      data.append(ProgramStats(d, percentage(asum+isum, psum),
+        percentage(asum, psum), percentage(isum, psum),
+        percentage(acsum+icsum, pcsum),
+        percentage(acsum, pcsum), percentage(icsum, pcsum)))
+    else:
+      data.append(ProgramStats(d))
+  if lastIndex >= 0:
+    ranked = sorted([t for t in cdata if rank(t, cumAttr) > 0],
+      key=lambda t: -rank(t, cumAttr))
+  else:
+    ranked = []
+  return cdata, data, lastIndex, ranked
+
+def percentageArray (n, d):
+  # Vectorized version of percentage; the arithmetic is performed in
+  # the same order so that results (including rounding) are identical.
+  safe = numpy.where(d > 0, d, 1)
+  return numpy.where(d > 0, numpy.round((n/safe)*100), 0).astype(int)
+
+def computeProgramDataNumpy (dates, map, classrooms, today, cumAttr):
+  # Same as computeProgramData, but computed using (classroom x date)
+  # arrays.  Unlike the Python engine, no placeholder Count objects
+  # are created for missing counts, i.e., the ClassroomStats objects
+  # for such dates have no 'count' attribute.
+  dates = list(dates)
+  # Dates are in order, so the past dates form a prefix.
+  n = 0
+  while n < len(dates) and dates[n].date <= today: n += 1
+  lastIndex = n-1
+  C = len(classrooms)
+  rowIndex = dict((c.pk, i) for i, c in enumerate(classrooms))
+  columnIndex = dict((d.pk, j) for j, d in enumerate(dates[:n]))
+  found = numpy.zeros((C, n), dtype=bool)
+  enrollment = numpy.zeros((C, n), dtype=numpy.int64)
+  value = numpy.zeros((C, n), dtype=numpy.int64)
+  active = numpy.zeros((C, n), dtype=numpy.int64)
+  inactive = numpy.zeros((C, n), dtype=numpy.int64)
+  absentees = numpy.zeros((C, n), dtype=numpy.int64)
+  counts = {}
+  for (classroomId, dateId), c in map.items():
+    i = rowIndex.get(classroomId)
+    j = columnIndex.get(dateId)
+    if i == None or j == None: continue
+    if c.activeValue == None:
+      c.activeValue = c.value
+      c.inactiveValue = 0
+    found[i, j] = True
+    enrollment[i, j] = c.enrollment
+    value[i, j] = c.value
+    active[i, j] = c.activeValue
+    inactive[i, j] = c.inactiveValue
+    absentees[i, j] = c.absentees
+    counts[(i, j)] = c
+  # A missing count is penalized by being given zero participation
+  # relative to the most recently observed enrollment, i.e., the
+  # enrollment is forward-filled, starting from the nominal
+  # enrollment.  Column 0 of `e` holds the nominal enrollment; `k`
+  # indexes the most recent column of `e` holding an observation.
+  e = numpy.concatenate((numpy.array([[c.enrollment] for c in classrooms],
+    dtype=numpy.int64).reshape(C, 1), enrollment), axis=1)
+  k = numpy.maximum.accumulate(numpy.where(found, numpy.arange(1, n+1), 0),
+    axis=1)
+  present = e[numpy.arange(C)[:, None], k] - absentees
+  presentSum = numpy.cumsum(present, axis=1)
+  activeSum = numpy.cumsum(active, axis=1)
+  inactiveSum = numpy.cumsum(inactive, axis=1)
+  cumulativeArrays = {
+    "presentSum": presentSum,
+    "activeSum": activeSum,
+    "inactiveSum": inactiveSum,
+    "combinedCumPct": percentageArray(activeSum+inactiveSum, presentSum),
+    "activeCumPct": percentageArray(activeSum, presentSum),
+    "inactiveCumPct": percentageArray(inactiveSum, presentSum)
+  }
+  # Convert to lists of Python ints for use in objects.
+  columns = dict((a, v.tolist()) for a, v in cumulativeArrays.items())
+  eventColumns = dict((a, v.tolist()) for a, v in {
+    "combinedPct": percentageArray(value, present),
+    "activePct": percentageArray(active, present),
+    "inactivePct": percentageArray(inactive, present) }.items())
+  cdata = []
+  for i, c in enumerate(classrooms):
+    l = []
+    for j, d in enumerate(dates):
+      s = ClassroomStats(d)
+      if j < n:
+        for a, v in columns.items(): setattr(s, a, v[i][j])
+        if (i, j) in counts:
+          s.count = counts[(i, j)]
+          for a, v in eventColumns.items(): setattr(s, a, v[i][j])
+      l.append(s)
+    cdata.append((c, l[lastIndex] if lastIndex >= 0 else None, l))
+  # Program statistics.
+  asum = active.sum(axis=0)
+  isum = inactive.sum(axis=0)
+  psum = present.sum(axis=0)
+  acsum = activeSum.sum(axis=0)
+  icsum = inactiveSum.sum(axis=0)
+  pcsum = presentSum.sum(axis=0)
+  l = [v.tolist() for v in (percentageArray(asum+isum, psum),
+    percentageArray(asum, psum), percentageArray(isum, psum),
+    percentageArray(acsum+icsum, pcsum), percentageArray(acsum, pcsum),
+    percentageArray(icsum, pcsum))]
+  data = [ProgramStats(d, *[v[j] for v in l]) if j < n else ProgramStats(d)\
+    for j, d in enumerate(dates)]
+  # Rankings.  A stable sort preserves classroom order among ties, as
+  # does the Python engine.
+  if lastIndex >= 0:
+    last = cumulativeArrays[cumAttr][:, lastIndex]
+    ranked = [cdata[i] for i in numpy.argsort(-last, kind="stable")\
+      if last[i] > 0]
+  else:
+    ranked = []
+  return cdata, data, lastIndex, ranked
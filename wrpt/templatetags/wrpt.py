@@ -11,7 +11,3 @@ register = template.Library()
 @register.simple_tag
 def getattr_or_empty (object, attr):
   return getattr(object, attr, "")
-
-@register.simple_tag
-def getattr_or_null (objectList, index, attr):
-  return getattr(objectList[index], attr, "null")
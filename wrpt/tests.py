@@ -0,0 +1,459 @@
+# =============================================================================
+# Walk&Roll Performance Tracking
+# Copyright (c) 2014, Greg Janee <gregjanee@gmail.com>
+# License: http://www.gnu.org/licenses/gpl-2.0.html
+# -----------------------------------------------------------------------------
+
+# Tests, run by `manage.py test wrpt`.  Each test builds its own
+# fixtures; a private memory cache is used so that the site's cache is
+# neither consulted nor disturbed.
+
+import csv
+import datetime
+import io
+import random
+import re
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.test import Client, TestCase, TransactionTestCase,\
+  override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from wrpt import audit, caching, cumulative
+from wrpt.aggregates import cumulativeSums, windowCumulativeStats
+from wrpt.models import Classroom, Count, EventDate, PageSnapshot, Program,\
+  Schedule, School, WrptUser, defaultSchoolYear
+from wrpt.stats import computeProgramData, computeProgramDataNumpy, numpy
+
+privateCache = override_settings(CACHES={ "default": { "BACKEND":
+  "django.core.cache.backends.locmem.LocMemCache" } })
+
+classroomAttrs = ["presentSum", "activeSum", "inactiveSum", "combinedCumPct",
+  "activeCumPct", "inactiveCumPct", "combinedPct", "activePct", "inactivePct"]
+programAttrs = ["combinedPct", "activePct", "inactivePct", "combinedCumPct",
+  "activeCumPct", "inactiveCumPct"]
+cumAttrs = ["combinedCumPct", "activeCumPct", "inactiveCumPct"]
+
+def createSchedule (name, offsets):
+  # Creates a schedule whose event dates are the given numbers of days
+  # from today.
+  today = datetime.date.today()
+  s = Schedule.objects.create(name=name)
+  EventDate.objects.bulk_create([EventDate(schedule=s,
+    date=today+datetime.timedelta(days=o)) for o in offsets])
+  return s
+
+def createProgram (schoolName, schedule, splitCounts, seed):
+  # Creates a program in the current school year with classrooms
+  # exercising the cases the statistics must handle: counts on every
+  # date (with absentees), counts on some dates only (the enrollment
+  # varying between them, so that missing counts are penalized
+  # relative to a changing enrollment), no counts at all, and zero
+  # participation.  Counts are recorded for past dates only.
+  r = random.Random(seed)
+  program = Program.objects.create(
+    school=School.objects.create(name=schoolName),
+    schoolYear=defaultSchoolYear(), schedule=schedule,
+    splitCounts=splitCounts)
+  today = datetime.date.today()
+  dates = [d for d in EventDate.objects.filter(schedule=schedule)\
+    .order_by("date") if d.date <= today]
+  patterns = [("all", 20), ("some", 25), ("none", 18), ("zero", 22),
+    ("some", 30), ("all", 1)]
+  counts = []
+  for i, (pattern, enrollment) in enumerate(patterns):
+    c = Classroom.objects.create(program=program, name="Room %d" % (i+1),
+      enrollment=enrollment)
+    for j, d in enumerate(dates):
+      if pattern == "none" or (pattern == "some" and j%3 == 1): continue
+      e = max(1, enrollment + r.randint(-2, 2))
+      absentees = r.randint(0, min(3, e-1)) if pattern != "zero" else 0
+      value = r.randint(0, e-absentees) if pattern != "zero" else 0
+      if splitCounts:
+        active = r.randint(0, value)
+        counts.append(Count(program=program, eventDate=d, classroom=c,
+          enrollment=e, value=value, activeValue=active,
+          inactiveValue=value-active, absentees=absentees))
+      else:
+        counts.append(Count(program=program, eventDate=d, classroom=c,
+          enrollment=e, value=value, absentees=absentees))
+  Count.objects.bulk_create(counts)
+  return program
+
+def differences (reference, other):
+  # Returns a list of descriptions of the differences between two
+  # results of the form returned by computeProgramData.
+  l = []
+  rcdata, rdata, rlastIndex, rranked = reference
+  ocdata, odata, olastIndex, oranked = other
+  if rlastIndex != olastIndex: l.append("last index")
+  for (c, _, rl), (_, _, ol) in zip(rcdata, ocdata):
+    for rs, os in zip(rl, ol):
+      for a in classroomAttrs:
+        if getattr(rs, a, None) != getattr(os, a, None):
+          l.append("classroom %s, %s, %s: %r != %r" % (c.name, rs.date, a,
+            getattr(rs, a, None), getattr(os, a, None)))
+  for rs, os in zip(rdata, odata):
+    for a in programAttrs:
+      if getattr(rs, a, None) != getattr(os, a, None):
+        l.append("program, %s, %s: %r != %r" % (rs.date, a,
+          getattr(rs, a, None), getattr(os, a, None)))
+  if [t[0].pk for t in rranked] != [t[0].pk for t in oranked]:
+    l.append("ranking")
+  return l
+
+def programInputs (program):
+  # Returns (dates, map, classrooms) as loaded by the program view.
+  # Each engine must be given a fresh map, as the engines normalize
+  # counts in place.
+  dates = list(EventDate.objects.filter(schedule=program.schedule_id)\
+    .order_by("date"))
+  map = dict(((c.classroom_id, c.eventDate_id), c)\
+    for c in Count.objects.filter(program=program))
+  classrooms = list(Classroom.objects.filter(program=program)\
+    .order_by("name"))
+  return dates, map, classrooms
+
+def fetchPages (test, client, urls):
+  # Returns the contents of the pages at the given URLs, less CSRF
+  # tokens, which differ from rendering to rendering.
+  l = []
+  for url in urls:
+    r = client.get(url)
+    test.assertEqual(r.status_code, 200)
+    l.append(re.sub(rb'(name="csrfmiddlewaretoken" value=)"[^"]*"',
+      rb"\1", r.content))
+  return l
+
+@privateCache
+class EngineParityTests (TestCase):
+  # The numpy and sql program statistics engines must produce exactly
+  # the results of the python engine.
+  def setUp (self):
+    schedule = createSchedule("Weekly", [-42, -35, -28, -21, -14, -7, 0, 7,
+      14])
+    self.programs = [createProgram("Adams", schedule, False, 1),
+      createProgram("Lincoln", schedule, True, 2),
+      createProgram("Roosevelt", createSchedule("Future", [7, 14]), False, 3),
+      self.createRescheduledProgram()]
+  def createRescheduledProgram (self):
+    # Creates a program whose schedule was changed after counts were
+    # recorded.  Counts on dates not in the program's schedule must be
+    # disregarded, including their enrollments, which differ from the
+    # classrooms' nominal enrollments.
+    program = createProgram("Jefferson", createSchedule("Old", [-40, -30,
+      -20]), False, 4)
+    Count.objects.filter(program=program).update(
+      enrollment=models.F("enrollment")+5)
+    schedule = createSchedule("New", [-35, -25, -15, -5, 5])
+    Program.objects.filter(pk=program.pk).update(schedule=schedule)
+    program.refresh_from_db()
+    d = EventDate.objects.get(schedule=schedule, date=datetime.date.today()-\
+      datetime.timedelta(days=15))
+    Count.objects.bulk_create([Count(program=program, eventDate=d,
+      classroom=c, enrollment=c.enrollment, value=c.enrollment//2)\
+      for c in Classroom.objects.filter(program=program)[:3]])
+    return program
+  def assertEngineAgrees (self, name, engine):
+    today = datetime.date.today()
+    for p in self.programs:
+      for cumAttr in cumAttrs:
+        dates, map, classrooms = programInputs(p)
+        reference = computeProgramData(dates, map, classrooms, today,
+          cumAttr)
+        dates, map, classrooms = programInputs(p)
+        l = differences(reference, engine(p, dates, map, classrooms, today,
+          cumAttr))
+        self.assertEqual(l, [], "%s engine, %s, %s" % (name, p, cumAttr))
+  def testFixtures (self):
+    # Guards against the fixtures degenerating: rankings must be
+    # nontrivial and classrooms must be missing counts.
+    today = datetime.date.today()
+    dates, map, classrooms = programInputs(self.programs[0])
+    _, _, lastIndex, ranked = computeProgramData(dates, map, classrooms,
+      today, "combinedCumPct")
+    self.assertEqual(lastIndex, 6)
+    self.assertTrue(1 < len(ranked) < len(classrooms))
+    self.assertTrue(len(map) < len(classrooms)*(lastIndex+1))
+  def testNumpyEngine (self):
+    if numpy == None: self.skipTest("NumPy is not installed")
+    self.assertEngineAgrees("numpy", lambda program, dates, map, classrooms,
+      today, cumAttr: computeProgramDataNumpy(dates, map, classrooms, today,
+      cumAttr))
+  def testCumulativeSums (self):
+    # The sums underlying the leaderboard.
+    today = datetime.date.today()
+    for p in self.programs:
+      dates, map, classrooms = programInputs(p)
+      cdata, _, _, _ = computeProgramData(dates, map, classrooms, today,
+        "combinedCumPct")
+      self.assertEqual(cumulativeSums([p.pk], today),
+        dict((c.pk, (s.presentSum, s.activeSum, s.inactiveSum))\
+        for c, s, _ in cdata if s != None), str(p))
+  def testStoredCumulativeStats (self):
+    # Cumulative statistics from the CumulativeStats table (as used by
+    # the classroom view and the python engine) must match a full
+    # recomputation, whether computed on first use, read back from the
+    # table, or refreshed incrementally after a count changes.
+    def load (program, dates, map, classrooms, today, cumAttr):
+      return computeProgramData(dates, map, classrooms, today, cumAttr,
+        cumulative.loadCumulativeStats(classrooms, dates, map, today))
+    self.assertEngineAgrees("table (computed)", load)
+    self.assertEngineAgrees("table (stored)", load)
+    for p in self.programs:
+      c = Count.objects.filter(program=p, eventDate__schedule=p.schedule_id,
+        value__gt=0).select_related("eventDate")\
+        .order_by("eventDate__date").first()
+      if c == None: continue
+      # The update bypasses the signals, which act only on commit.
+      values = { "value": c.value-1 }
+      if p.splitCounts:
+        f = "activeValue" if c.activeValue > 0 else "inactiveValue"
+        values[f] = getattr(c, f)-1
+      Count.objects.filter(pk=c.pk).update(**values)
+      cumulative.refreshCumulativeStats(c.classroom_id, c.eventDate.date)
+    self.assertEngineAgrees("table (refreshed)", load)
+  def testSqlEngine (self):
+    self.assertEngineAgrees("sql", lambda program, dates, map, classrooms,
+      today, cumAttr: computeProgramData(dates, map, classrooms, today,
+      cumAttr, windowCumulativeStats(program.pk, today)))
+
+@privateCache
+class InvalidationTests (TransactionTestCase):
+  # No stale page may be cached under a program's new data version.
+  # The program and classroom pages are requested as an anonymous
+  # visitor at the moment the program's version is bumped (i.e., as
+  # soon as the new version is visible to other requests), caching
+  # them under the new version; once the change has been committed,
+  # the cached pages must match freshly rendered ones.  (This fails if
+  # derived data such as cumulative statistics is refreshed only after
+  # the bump.)  Invalidation happens when transactions commit, hence a
+  # TransactionTestCase.
+  def setUp (self):
+    schedule = createSchedule("Weekly", [-21, -14, -7, 7])
+    self.program = createProgram("Adams", schedule, False, 1)
+    self.count = Count.objects.filter(program=self.program, value__gt=0)\
+      .select_related("program").order_by("-eventDate__date").first()
+    self.urls = [reverse("program", args=(self.program.pk,)),
+      reverse("classroom", args=(self.count.classroom_id,))]
+    self.client = Client()
+  def fetch (self):
+    return fetchPages(self, self.client, self.urls)
+  def assertNotStale (self, change):
+    cache.clear()
+    self.fetch()
+    bumps = []
+    bump = caching.bumpProgramVersion
+    def bumpAndFetch (*programIds):
+      bump(*programIds)
+      if self.program.pk in programIds:
+        bumps.append(programIds)
+        self.fetch()
+    caching.bumpProgramVersion = bumpAndFetch
+    try:
+      with transaction.atomic():
+        change()
+    finally:
+      caching.bumpProgramVersion = bump
+    self.assertTrue(len(bumps) > 0, "program version not bumped")
+    cached = self.fetch()
+    cache.clear()
+    self.assertEqual(cached, self.fetch())
+  def testCountSaved (self):
+    def change ():
+      self.count.value -= 1
+      self.count.save()
+    self.assertNotStale(change)
+  def testCountDeleted (self):
+    self.assertNotStale(self.count.delete)
+
+@privateCache
+class SnapshotTests (TestCase):
+  # A snapshotted program's pages must be served from page snapshots,
+  # which must match the pages as computed without snapshots, and
+  # which must be rebuilt once obsoleted by a change to the program's
+  # data.
+  def setUp (self):
+    schedule = createSchedule("Weekly", [-42, -35, -28, -21, -14, -7])
+    self.program = createProgram("Adams", schedule, True, 1)
+    Program.objects.filter(pk=self.program.pk).update(schoolYear="2000-2001")
+    self.program.refresh_from_db()
+    self.urls = []
+    for c in ["", "?c=a", "?c=i"]:
+      self.urls.append(reverse("program", args=(self.program.pk,)) + c)
+      self.urls.append(reverse("program_stats", args=(self.program.pk,)) + c)
+    for id in Classroom.objects.filter(program=self.program)\
+      .values_list("pk", flat=True):
+      self.urls.append(reverse("classroom", args=(id,)))
+      self.urls.append(reverse("classroom_stats", args=(id,)))
+    self.client = Client()
+  def fetch (self):
+    cache.clear()
+    return fetchPages(self, self.client, self.urls)
+  def snapshot (self):
+    call_command("snapshotprograms", self.program.pk, stdout=io.StringIO())
+  def pageSnapshots (self):
+    return sorted(PageSnapshot.objects.filter(snapshot__program=self.program)\
+      .values_list("page", "generation"))
+  def testSnapshotsMatch (self):
+    reference = self.fetch()
+    self.snapshot()
+    pages = self.pageSnapshots()
+    self.assertEqual(len(pages),
+      3+Classroom.objects.filter(program=self.program).count())
+    self.assertEqual(self.fetch(), reference)
+    # Pages are served from their snapshots, which are not rebuilt.
+    self.assertEqual(self.pageSnapshots(), pages)
+    PageSnapshot.objects.filter(snapshot__program=self.program).delete()
+    self.assertEqual(self.fetch(), reference)
+    self.assertEqual(self.pageSnapshots(), pages)
+  def testSnapshotsInvalidated (self):
+    self.snapshot()
+    before = self.fetch()
+    c = Count.objects.filter(program=self.program, value__gt=0).first()
+    c.value -= 1
+    c.activeValue = c.value
+    c.inactiveValue = 0
+    c.save()
+    after = self.fetch()
+    self.assertNotEqual(after, before)
+    self.assertEqual(set(g for _, g in self.pageSnapshots()), set([1]))
+    call_command("snapshotprograms", self.program.pk, delete=True,
+      stdout=io.StringIO())
+    self.assertEqual(self.fetch(), after)
+
+@privateCache
+class ImportTests (TestCase):
+  # Counts imported in the import view or by the importcounts command
+  # are audited under the importing user, and a file that is not valid
+  # CSV is reported as an error.  Audit records are captured as they
+  # are queued rather than written.
+  def setUp (self):
+    self.program = createProgram("Adams", createSchedule("Weekly", [-14,
+      -7]), False, 1)
+    self.date = EventDate.objects.filter(schedule=self.program.schedule_id)\
+      .order_by("date").first()
+    self.staff = WrptUser.objects.create(username="staff", is_staff=True)
+    self.audits = []
+    self.record = audit.record
+    audit.record = lambda message, audits: self.audits.extend(audits)
+  def tearDown (self):
+    audit.record = self.record
+  def csvFile (self, value):
+    # Returns a CSV file creating a count in the classroom that has
+    # none, with the given comments.
+    return ("program,eventDate,classroom,enrollment,value,activeValue," +\
+      "inactiveValue,absentees,comments\n%s,%s,Room 3,18,7,,,0,%s\n") %\
+      (self.program, self.date.date, value)
+  def upload (self, content):
+    client = Client()
+    client.force_login(self.staff)
+    f = io.BytesIO(content.encode())
+    f.name = "counts.csv"
+    return client.post(reverse("import_counts"), { "file": f })
+  def testView (self):
+    self.assertEqual(self.upload(self.csvFile("ok")).status_code, 302)
+    self.assertEqual([(a.username, a.operation, a.commentsAfter)\
+      for a in self.audits], [("staff", "create", "ok")])
+  def testInvalidCsv (self):
+    r = self.upload(self.csvFile("x"*(csv.field_size_limit()+1)))
+    self.assertContains(r, "File is not valid CSV")
+    self.assertEqual(self.audits, [])
+    self.assertFalse(Count.objects.filter(program=self.program,
+      classroom__name="Room 3").exists())
+  def testCommand (self):
+    with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+      f.write(self.csvFile("ok"))
+      f.flush()
+      call_command("importcounts", f.name, user="importer",
+        stdout=io.StringIO())
+    self.assertEqual([(a.username, a.remoteAddress, a.operation)\
+      for a in self.audits], [("importer", "", "create")])
+
+@privateCache
+class QueryBudgetTests (TestCase):
+  # The number of database queries issued by each public view must not
+  # grow with the amount of data.  For each of two data sizes,
+  # synthetic data is generated (see the generatedata command) and the
+  # views are requested as an anonymous visitor, a teacher (who sees
+  # count entry forms) and a staff member, capturing queries.  Each
+  # page is requested once beforehand so that lazily computed data
+  # (e.g., cumulative statistics) is in place, and the cache is
+  # cleared before each measured request so that pages are actually
+  # rendered.  A failure lists the queries issued at both sizes.
+  sizes = [(2, 3, 5), (4, 8, 12)] # schools, classrooms, dates
+  prefix = "Query budget"
+  def pages (self, program, classroom):
+    # Returns [(description, user, URL), ...]; user is one of
+    # "anonymous", "teacher" and "staff".
+    l = []
+    for user in ["anonymous", "teacher", "staff"]:
+      l.append(("home", user, "/"))
+      l.append(("leaderboard", user, reverse("leaderboard")))
+      for c in ["", "?c=a", "?c=i"]:
+        l.append(("program%s" % c, user,
+          reverse("program", args=(program.pk,)) + c))
+      l.append(("program stats", user,
+        reverse("program_stats", args=(program.pk,))))
+      l.append(("classroom", user,
+        reverse("classroom", args=(classroom.pk,))))
+      l.append(("classroom stats", user,
+        reverse("classroom_stats", args=(classroom.pk,))))
+    l.append(("enter counts", "teacher",
+      reverse("enter_counts", args=(program.pk,))))
+    l.append(("search", "staff", reverse("search") + "?q=room"))
+    l.append(("dump counts", "staff", reverse("dump_counts")))
+    l.append(("dump counts (program)", "staff",
+      reverse("dump_counts") + "?program=%d" % program.pk))
+    return l
+  def request (self, client, url):
+    # Returns (status code, [SQL, ...]).
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+      r = client.get(url)
+      # Streaming responses do their work as they are consumed.
+      if r.streaming: b"".join(r.streaming_content)
+    return r.status_code, [q["sql"] for q in queries.captured_queries]
+  def measure (self, size):
+    # Returns { (description, user): (status code, [SQL, ...]) }.  The
+    # generated data is rolled back.
+    schools, classrooms, dates = size
+    results = {}
+    with transaction.atomic():
+      # Two years of data are generated; the pages of a past year's
+      # program, all of whose event dates have passed, are measured.
+      call_command("generatedata", prefix=self.prefix, schools=schools,
+        classrooms=classrooms, dates=dates, years=2, seed=1,
+        stdout=io.StringIO())
+      program = Program.objects.filter(school__name__startswith=self.prefix)\
+        .order_by("schoolYear", "school__name").first()
+      classroom = Classroom.objects.filter(program=program)\
+        .order_by("name").first()
+      clients = { "anonymous": Client() }
+      for user in ["teacher", "staff"]:
+        u = WrptUser(username="%s %s" % (self.prefix, user),
+          is_staff=(user == "staff"),
+          school=(program.school if user == "teacher" else None))
+        u.save()
+        clients[user] = Client()
+        clients[user].force_login(u)
+      for description, user, url in self.pages(program, classroom):
+        self.request(clients[user], url)
+        results[(description, user)] = self.request(clients[user], url)
+      transaction.set_rollback(True)
+    return results
+  def testQueryCounts (self):
+    labels = ["x".join(str(v) for v in s) for s in self.sizes]
+    small, large = [self.measure(s) for s in self.sizes]
+    for key in small:
+      with self.subTest(page=key[0], user=key[1]):
+        self.assertIn(small[key][0], [200, 302])
+        self.assertIn(large[key][0], [200, 302])
+        self.assertEqual(len(small[key][1]), len(large[key][1]),
+          "\nQueries at size %s:\n  %s\nQueries at size %s:\n  %s" %\
+          (labels[0], "\n  ".join(small[key][1]), labels[1],
+          "\n  ".join(large[key][1])))
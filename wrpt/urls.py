@@ -13,8 +13,19 @@ from wrpt import views
 urlpatterns = [
   path("", views.home),
   path("program/<int:id>", views.program, name="program"),
+  path("program/<int:id>/enter_counts", views.enterCounts,
+    name="enter_counts"),
+  path("program/<int:id>/stats.json", views.programStats,
+    name="program_stats"),
   path("classroom/<int:id>", views.classroom, name="classroom"),
+  path("classroom/<int:id>/stats.json", views.classroomStats,
+    name="classroom_stats"),
+  path("leaderboard", views.leaderboard, name="leaderboard"),
   path("dump_counts", views.dumpCounts, name="dump_counts"),
+  path("import_counts", views.importCounts, name="import_counts"),
+  path("import_roster", views.importRoster, name="import_roster"),
+  path("search", views.searchCounts, name="search"),
+  path("metrics", views.metrics, name="metrics"),
   path("login", LoginView.as_view(template_name="wrpt/login.html"),
     name="login"),
   path("logout", LogoutView.as_view(), name="logout"),
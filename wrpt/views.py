@@ -7,152 +7,190 @@
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.gzip import gzip_page
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseBadRequest,\
+  HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.db import IntegrityError, models, transaction
 from django.db.models import Sum
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 import csv
 import datetime
 import io
-import logging
 
+from wrpt import audit, caching, search, snapshots
+from wrpt.aggregates import cumulativeSums, windowCumulativeStats
+from wrpt.charts import renderCharts
+from wrpt.importer import importCounts as importCountsFile, importRoster\
+  as importRosterChanges, rosterChanges
+from wrpt.cumulative import loadCumulativeStats
+from wrpt.loaders import ClassroomDataLoader
+from wrpt.metrics import exposition
 from wrpt.models import Classroom, Count, EventDate, Program
-from wrpt.forms import CountForm
+from wrpt.signals import countsChanged
+from wrpt.forms import CountForm, CountRowForm, DumpCountsForm,\
+  ImportCountsForm, ImportRosterForm, SearchForm
+from wrpt.stats import computeClassroomData, computeProgramData,\
+  computeProgramDataNumpy, percentage, programStatsEngine, rank
 
 maximumTableWidth = 20 # columns
 maximumRankedClassrooms = 6
 
-def percentage (n, d):
-  # Returns n/d as an integer percentage, safely.
-  if d > 0:
-    return round((n/d)*100)
-  else:
-    return 0
-
-class ClassroomStats (object):
-  # This class is more complex than would seem to be necessary because
-  # of the need to accommodate three cases: a date for which there is
-  # a count; a date for which no count was recorded (in which case
-  # percentages are not displayed in the table, but cumulative counts
-  # and percentages are still computed and displayed in the graph);
-  # and a date in the future (which holds no data and serves only as a
-  # placeholder).  Note that the supplied count is stored and may be
-  # modified.
-  def __init__ (self, date, count=None, prev=None,
-    computeEventDatePercentages=True):
-    self.date = date
-    if count == None: return
-    self.count = count
-    if count.activeValue == None:
-      count.activeValue = count.value
-      count.inactiveValue = 0
-    present = count.enrollment - count.absentees
-    self.presentSum = present
-    self.activeSum = count.activeValue
-    self.inactiveSum = count.inactiveValue
-    if prev != None:
-      self.presentSum += prev.presentSum
-      self.activeSum += prev.activeSum
-      self.inactiveSum += prev.inactiveSum
-    self.combinedCumPct = percentage(self.activeSum+self.inactiveSum,
-      self.presentSum)
-    self.activeCumPct = percentage(self.activeSum, self.presentSum)
-    self.inactiveCumPct = percentage(self.inactiveSum, self.presentSum)
-    if computeEventDatePercentages:
-      self.combinedPct = percentage(count.value, present)
-      self.activePct = percentage(count.activeValue, present)
-      self.inactivePct = percentage(count.inactiveValue, present)
-
-class ProgramStats (object):
-  # Simpler than the preceding, there are only two cases: a date for
-  # which there are percentages (for the event day and cumulative);
-  # and a date in the future (which holds no data and serves only as a
-  # placeholder).
-  def __init__ (self, date, combinedPct=None, activePct=None,
-    inactivePct=None, combinedCumPct=None, activeCumPct=None,
-    inactiveCumPct=None):
-    self.date = date
-    if combinedPct != None:
-      self.combinedPct = combinedPct
-      self.activePct = activePct
-      self.inactivePct = inactivePct
-      self.combinedCumPct = combinedCumPct
-      self.activeCumPct = activeCumPct
-      self.inactiveCumPct = inactiveCumPct
+def programCanBeUpdated (user, program):
+  return user.is_authenticated and\
+    (user.is_staff or user.school == program.school)
 
 def formCanBeSubmitted (user, classroom):
-  return user.is_authenticated and\
-    (user.is_staff or user.school == classroom.program.school)
+  return programCanBeUpdated(user, classroom.program)
 
 def log (request, operation, count1, count2=None):
-  logging.getLogger("wrpt").info(
-    "[WRPT] %s %s %s %s%s%s" % (request.META.get("REMOTE_ADDR", "unknown"),
-    request.user.username, operation,
-    "FROM=" if operation == "update" else "", count1,
-    " TO="+count2 if operation == "update" else ""))
+  # Logs and audits a count operation (see wrpt.audit).  `count1` and
+  # `count2` are Count objects, as for audit.countAudit; the counts
+  # must not be modified subsequently.
+  remoteAddress = request.META.get("REMOTE_ADDR")
+  audit.record("[WRPT] %s %s %s" % (remoteAddress or "unknown",
+    request.user.username, audit.operationFormat(operation, count1, count2)),
+    [audit.countAudit(request.user.username, remoteAddress, operation,
+    count1, count2)])
+
+def logBatch (request, operations):
+  # Logs and audits a batch of count operations (see
+  # audit.recordBatch) performed by the request's user.
+  audit.recordBatch(request.user.username, request.META.get("REMOTE_ADDR"),
+    operations)
 
 def home (request):
-  current = []
-  past = []
-  for p in Program.objects.all().select_related("school")\
-    .order_by("-schoolYear", "school__name"):
-    if p.isViable():
+  today = datetime.date.today()
+  listing = caching.getProgramListing(today)
+  if listing == None:
+    current = []
+    past = []
+    # A program needs at least one classroom to be considered viable
+    # (cf. Program.isViable); counting classrooms in the same query
+    # avoids a query per program.
+    for p in Program.objects.all().select_related("school")\
+      .annotate(numClassrooms=models.Count("classroom"))\
+      .filter(numClassrooms__gt=0).order_by("-schoolYear", "school__name"):
       if p.isCurrent():
         current.append(p)
       else:
         past.append(p)
-  return render(request, "wrpt/home.html", { "currentPrograms": current,
-    "pastPrograms": past })
-
-def computeClassroomData (dates, map, classroom, today):
-  # Returns ([ClassroomStats, ...], lastIndex).  A ClassroomStats
-  # object is returned for each date; those after `today` are empty
-  # placeholders.  `lastIndex` is the index of the last non-empty
-  # ClassroomStats, or -1 if they're all empty.
-  stats = []
-  lastEnrollment = classroom.enrollment
-  i = -1
-  for d in dates:
-    if d.date <= today:
-      i += 1
-      # If the classroom has no count recorded for the event date, it
-      # is penalized by being given zero participation relative to its
-      # most recently observed enrollment.
-      if (classroom.pk, d.pk) in map:
-        c = map[(classroom.pk, d.pk)]
-        lastEnrollment = c.enrollment
-        countFound = True
-      else:
-        c = Count(enrollment=lastEnrollment, value=0)
-        countFound = False
-      s = ClassroomStats(d, c, stats[-1] if len(stats) > 0 else None,
-        computeEventDatePercentages=countFound)
-    else:
-      s = ClassroomStats(d)
-    stats.append(s)
-  return stats, i
+    listing = render_to_string("wrpt/program_list.html",
+      { "currentPrograms": current, "pastPrograms": past })
+    caching.setProgramListing(today, listing)
+  return render(request, "wrpt/home.html",
+    { "programListing": mark_safe(listing) })
 
-def addClassroomData (context, classroom):
-  dates = EventDate.objects.filter(
-    schedule=classroom.program.schedule).order_by("date")
-  map = dict(((classroom.pk, c.eventDate.pk), c)\
-    for c in Count.objects.filter(classroom=classroom)\
-    .select_related("eventDate"))
-  context["hasData"] = (len(map) > 0)
+def addClassroomData (context, loader):
+  classroom = loader.classroom
+  context["hasData"] = (len(loader.map) > 0)
   if context["hasData"]:
-    context["dates"] = dates
-    context["data"], i =\
-      computeClassroomData(dates, map, classroom, datetime.date.today())
-    context["lastStats"] = context["data"][i] if i >= 0 else None
-    # It's a pain to do slicing inside templates, so compute the table
-    # slices here.
-    slices = []
-    for i in range((len(dates)-1)//maximumTableWidth+1):
-      slices.append("%d:%d" % (i*maximumTableWidth,
-        min((i+1)*maximumTableWidth, len(dates))))
-    context["tableSlices"] = slices
+    today = datetime.date.today()
+    cumulative = loadCumulativeStats([classroom], loader.dates, loader.map,
+      today)
+    addClassroomStats(context, classroom, loader.dates, loader.map, today,
+      cumulative[classroom.pk])
+
+def addClassroomStats (context, classroom, dates, map, today,
+  cumulative=None):
+  # The computational part of addClassroomData (cf. addProgramStats).
+  # `cumulative` is as in computeClassroomData.
+  context["dates"] = dates
+  context["data"], i = computeClassroomData(dates, map, classroom, today,
+    cumulative)
+  context["lastStats"] = context["data"][i] if i >= 0 else None
+  # It's a pain to do slicing inside templates, so compute the table
+  # slices here.
+  slices = []
+  for i in range((len(dates)-1)//maximumTableWidth+1):
+    slices.append("%d:%d" % (i*maximumTableWidth,
+      min((i+1)*maximumTableWidth, len(dates))))
+  context["tableSlices"] = slices
+
+def classroomLabel (classroom):
+  # The classroom view is also used to view one-classroom programs.
+  if classroom.name == "entire school" and\
+    classroom.program.classroom_set.count() == 1:
+    return "school"
+  else:
+    return "classroom"
+
+def addClassroomGraphs (context, classroom):
+  context["graphs"] = [{ "name": "chart", "yAxisLabel": context["label"],
+    "plotGoal": True }]
+  if classroom.program.splitCounts:
+    context["graphs"][0]["series"] = [
+      ("Overall", context["data"], "combinedCumPct"),
+      ("Walk/bike", context["data"], "activeCumPct"),
+      ("Carpool/bus", context["data"], "inactiveCumPct")]
+    # Order the series by total to date... the overall value will
+    # always be largest.
+    if context["lastStats"] != None and\
+      context["lastStats"].inactiveCumPct >\
+      context["lastStats"].activeCumPct:
+      l = context["graphs"][0]["series"]
+      l[1], l[2] = l[2], l[1]
+  else:
+    context["graphs"][0]["series"] =\
+      [("Participation", context["data"], "combinedCumPct")]
+
+def chartData (context):
+  # Returns the data for the charts described by context["graphs"],
+  # which has the form:
+  #
+  #   [{ "name": str, # chart name
+  #      "yAxisLabel": str,
+  #      "plotGoal": bool,
+  #      "series": [(label, [ClassroomStats|ProgramStats, ...],
+  #        attribute name), ...] }, ...]
+  #
+  # in columnar form, as used by wrpt.charts.renderCharts and served as
+  # JSON by the stats views below:
+  #
+  #   { "dates": [ISO date, ...], "labels": [date label, ...],
+  #     "goal": int|null,
+  #     "charts": [{ "name": str, "yAxisLabel": str, "plotGoal": bool,
+  #       "series": [{ "label": str, "values": [int|null, ...] }, ...]
+  #     }, ...] }
+  #
+  # Values are null for dates in the future.
+  if not context["hasData"]:
+    return { "dates": [], "labels": [],
+      "goal": context["program"].participationGoal, "charts": [] }
+  return { "dates": [d.date.isoformat() for d in context["dates"]],
+    "labels": [str(d) for d in context["dates"]],
+    "goal": context["program"].participationGoal,
+    "charts": [{ "name": g["name"], "yAxisLabel": g["yAxisLabel"],
+      "plotGoal": g["plotGoal"],
+      "series": [{ "label": label,
+        "values": [getattr(s, attr, None) for s in data] }\
+        for label, data, attr in g["series"]] } for g in context["graphs"]] }
+
+def addCharts (context, name=None):
+  # Adds the charts described by context["graphs"], rendered as SVG,
+  # as context["charts"] = { chart name: SVG }.  The rendering is
+  # cached under the program's data version; `name` distinguishes the
+  # program's charts.  If `name` is None, the charts are rendered
+  # without caching.
+  program = context["program"]
+  if program.splitCounts and context.get("category"):
+    title = "Cumulative performance - " + context["category"]
+  else:
+    title = "Cumulative performance"
+  if name == None:
+    context["charts"] = renderCharts(chartData(context), title)
+  else:
+    context["charts"] = caching.cachedProgramValue(program.pk, name,
+      lambda: renderCharts(chartData(context), title))
+
+def classroomProgramId (id):
+  return Classroom.objects.filter(pk=id).values_list("program_id", flat=True)\
+    .first()
 
+@caching.cachedPage(classroomProgramId)
 def classroom (request, id):
   try:
     classroom = Classroom.objects.select_related("program",
@@ -160,16 +198,23 @@ def classroom (request, id):
   except Classroom.DoesNotExist:
     raise Http404
   canSubmit = formCanBeSubmitted(request.user, classroom)
+  snapshot = snapshots.classroomPage(classroom)
+  if snapshot != None:
+    loader = ClassroomDataLoader(classroom, snapshot["dates"],
+      snapshot["counts"])
+  else:
+    loader = ClassroomDataLoader(classroom)
   if request.method == "POST":
     # Should never happen.
     if not canSubmit: raise PermissionDenied
-    form = CountForm(request.POST, classroom=classroom, canSubmit=canSubmit)
+    form = CountForm(request.POST, classroom=classroom, canSubmit=canSubmit,
+      loader=loader)
     if form.is_valid():
       try:
         c = Count.objects.get(program=classroom.program,
           eventDate=form.cleaned_data["eventDate"], classroom=classroom)
         if form.cleaned_data["value"] != None:
-          before = c.logFormat()
+          before = audit.snapshot(c)
           c.enrollment = form.cleaned_data["enrollment"]
           c.value = form.cleaned_data["value"]
           c.activeValue = form.cleaned_data["activeValue"]
@@ -177,11 +222,12 @@ def classroom (request, id):
           c.absentees = form.cleaned_data["absentees"]
           c.comments = form.cleaned_data["comments"]
           c.save()
-          log(request, "update", before, c.logFormat())
+          log(request, "update", before, c)
           messages.success(request, "Count updated.")
         else:
+          before = audit.snapshot(c)
           c.delete()
-          log(request, "delete", c.logFormat())
+          log(request, "delete", before)
           messages.success(request, "Count deleted.")
       except Count.DoesNotExist:
         if form.cleaned_data["value"] != None:
@@ -194,44 +240,42 @@ def classroom (request, id):
             absentees=form.cleaned_data["absentees"],
             comments=form.cleaned_data["comments"])
           c.save()
-          log(request, "create", c.logFormat())
+          log(request, "create", c)
           messages.success(request, "Count saved.")
         else:
           messages.success(request, "Did you mean to supply a count?")
       return HttpResponseRedirect(request.path)
   else:
-    form = CountForm(classroom=classroom, canSubmit=canSubmit)
+    form = CountForm(classroom=classroom, canSubmit=canSubmit, loader=loader)
   context = { "form": form, "classroom": classroom,
     "program": classroom.program, "canSubmit": canSubmit }
-  # This view is also used to view one-classroom programs.
-  if classroom.name == "entire school" and\
-    classroom.program.classroom_set.count() == 1:
-    context["label"] = "school"
+  if snapshot != None:
+    context.update(snapshot["context"])
   else:
-    context["label"] = "classroom"
-  addClassroomData(context, classroom)
-  if context["hasData"]:
-    context["graphs"] = [{ "name": "chart", "yAxisLabel": context["label"],
-      "plotGoal": True }]
-    if classroom.program.splitCounts:
-      context["graphs"][0]["series"] = [
-        ("Overall", context["data"], "combinedCumPct"),
-        ("Walk/bike", context["data"], "activeCumPct"),
-        ("Carpool/bus", context["data"], "inactiveCumPct")]
-      # Order the series by total to date... the overall value will
-      # always be largest.
-      if context["lastStats"] != None and\
-        context["lastStats"].inactiveCumPct >\
-        context["lastStats"].activeCumPct:
-        l = context["graphs"][0]["series"]
-        l[1], l[2] = l[2], l[1]
-    else:
-      context["graphs"][0]["series"] =\
-        [("Participation", context["data"], "combinedCumPct")]
+    context["label"] = classroomLabel(classroom)
+    addClassroomData(context, loader)
+    if context["hasData"]:
+      addClassroomGraphs(context, classroom)
+      addCharts(context, "classroom %d" % classroom.pk)
   return render(request, "wrpt/classroom.html", context)
 
-def rank (classroomDataTuple, cumAttr):
-  return getattr(classroomDataTuple[1], cumAttr)
+@caching.cachedPage(classroomProgramId, userIndependent=True)
+def classroomStats (request, id):
+  # Returns the classroom's chart data as JSON (see chartData).
+  try:
+    classroom = Classroom.objects.select_related("program",
+      "program__school", "program__schedule").get(pk=id)
+  except Classroom.DoesNotExist:
+    raise Http404
+  context = { "classroom": classroom, "program": classroom.program }
+  snapshot = snapshots.classroomPage(classroom)
+  if snapshot != None:
+    context.update(snapshot["context"])
+  else:
+    context["label"] = classroomLabel(classroom)
+    addClassroomData(context, ClassroomDataLoader(classroom))
+    if context["hasData"]: addClassroomGraphs(context, classroom)
+  return JsonResponse(chartData(context))
 
 def addProgramData (context, program, classrooms, cumAttr):
   dates = EventDate.objects.filter(
@@ -241,48 +285,45 @@ def addProgramData (context, program, classrooms, cumAttr):
     .select_related("classroom", "eventDate"))
   context["hasData"] = (len(map) > 0)
   if context["hasData"]:
-    context["dates"] = dates
     today = datetime.date.today()
-    cdata = []
-    for c in classrooms:
-      # N.B.: the last index will be the same for every classroom and
-      # the program generally.
-      l, lastIndex = computeClassroomData(dates, map, c, today)
-      cdata.append((c, l[lastIndex] if lastIndex >= 0 else None, l))
-    context["classroomData"] = cdata
-    data = []
-    for i, d in enumerate(dates):
-      if i <= lastIndex:
-        asum = isum = psum = acsum = icsum = pcsum = 0
-        for _, _, l in cdata:
-          asum += l[i].count.activeValue
-          isum += l[i].count.inactiveValue
-          psum += l[i].count.enrollment - l[i].count.absentees
-          acsum += l[i].activeSum
-          icsum += l[i].inactiveSum
-          pcsum += l[i].presentSum
-        data.append(ProgramStats(d, percentage(asum+isum, psum),
-          percentage(asum, psum), percentage(isum, psum),
-          percentage(acsum+icsum, pcsum),
-          percentage(acsum, pcsum), percentage(icsum, pcsum)))
-      else:
-        data.append(ProgramStats(d))
-    context["data"] = data
-    if lastIndex >= 0:
-      context["lastStats"] = context["data"][lastIndex]
-      context["classroomDataRanked"] = sorted(
-        [t for t in context["classroomData"] if rank(t, cumAttr) > 0],
-        key=lambda t: -rank(t, cumAttr))[:maximumRankedClassrooms]
+    engine = programStatsEngine()
+    if engine == "numpy":
+      cumulative = None
+    elif engine == "sql":
+      cumulative = windowCumulativeStats(program.pk, today)
     else:
-      context["lastStats"] = None
-      context["classroomDataRanked"] = []
-    # It's a pain to do slicing inside templates, so compute the table
-    # slices here.
-    slices = []
-    for i in range((len(dates)-1)//maximumTableWidth+1):
-      slices.append("%d:%d" % (i*maximumTableWidth,
-        min((i+1)*maximumTableWidth, len(dates))))
-    context["tableSlices"] = slices
+      cumulative = loadCumulativeStats(classrooms, dates, map, today)
+    addProgramStats(context, dates, map, classrooms, today, cumAttr,
+      cumulative)
+
+def addProgramStats (context, dates, map, classrooms, today, cumAttr,
+  cumulative=None):
+  # The computational part of addProgramData, separated out so that
+  # it can be run on in-memory data (see the benchmarkstats management
+  # command).  `cumulative` is as in computeProgramData and is ignored
+  # by the NumPy engine.
+  context["dates"] = dates
+  if programStatsEngine() == "numpy":
+    cdata, data, lastIndex, ranked =\
+      computeProgramDataNumpy(dates, map, classrooms, today, cumAttr)
+  else:
+    cdata, data, lastIndex, ranked = computeProgramData(dates, map,
+      classrooms, today, cumAttr, cumulative)
+  context["classroomData"] = cdata
+  context["data"] = data
+  if lastIndex >= 0:
+    context["lastStats"] = context["data"][lastIndex]
+    context["classroomDataRanked"] = ranked[:maximumRankedClassrooms]
+  else:
+    context["lastStats"] = None
+    context["classroomDataRanked"] = []
+  # It's a pain to do slicing inside templates, so compute the table
+  # slices here.
+  slices = []
+  for i in range((len(dates)-1)//maximumTableWidth+1):
+    slices.append("%d:%d" % (i*maximumTableWidth,
+      min((i+1)*maximumTableWidth, len(dates))))
+  context["tableSlices"] = slices
 
 def addStandingsStatement (context, cumAttr):
   ldquo, rdquo = "\u201C", "\u201D"
@@ -304,6 +345,33 @@ def addStandingsStatement (context, cumAttr):
     "cumulative participation of %d%%.") %\
     (numEvents, "s" if numEvents > 1 else "", who, best)
 
+def categoryAttributes (code):
+  # Returns (category, attr, cumAttr) for a category code: "a"
+  # (walk/bike), "i" (carpool/bus), or anything else (overall).
+  if code == "a":
+    return "walk/bike", "activePct", "activeCumPct"
+  elif code == "i":
+    return "carpool/bus", "inactivePct", "inactiveCumPct"
+  else:
+    return "overall", "combinedPct", "combinedCumPct"
+
+def programCategory (request):
+  # Returns (category, attr, cumAttr) as selected by the 'c' query
+  # parameter.
+  return categoryAttributes(request.GET.get("c"))
+
+def addProgramGraphs (context, cumAttr):
+  context["graphs"] = [{ "name": "program_chart", "yAxisLabel": "program",
+  "plotGoal": True,
+  "series": [("Participation", context["data"], cumAttr)] }]
+  if len(context["classroomDataRanked"]) > 0:
+    context["graphs"].append({ "name": "standings_chart",
+    "yAxisLabel": "classroom", "plotGoal": False,
+    "series": [(classroom.name, l, cumAttr)\
+    for classroom, _, l in context["classroomDataRanked"]] })
+    addStandingsStatement(context, cumAttr)
+
+@caching.cachedPage(lambda id: id)
 def program (request, id):
   try:
     program = Program.objects.select_related("school", "schedule").get(pk=id)
@@ -315,45 +383,290 @@ def program (request, id):
   elif len(classrooms) == 1 and classrooms[0].name == "entire school":
     return redirect("classroom", id=classrooms[0].pk)
   else:
-    if request.GET.get("c") == "a":
-      category = "walk/bike"
-      attr = "activePct"
-      cumAttr = "activeCumPct"
-    elif request.GET.get("c") == "i":
-      category = "carpool/bus"
-      attr = "inactivePct"
-      cumAttr = "inactiveCumPct"
-    else:
-      category = "overall"
-      attr = "combinedPct"
-      cumAttr = "combinedCumPct"
+    category, attr, cumAttr = programCategory(request)
     totalEnrollment = sum(c.enrollment for c in classrooms)
     context = { "program": program, "classrooms": classrooms,
       "category": category, "totalEnrollment": totalEnrollment,
-      "attr": attr, "cumAttr": cumAttr }
-    addProgramData(context, program, classrooms, cumAttr)
-    if context["hasData"]:
-      context["graphs"] = [{ "name": "program_chart", "yAxisLabel": "program",
-      "plotGoal": True,
-      "series": [("Participation", context["data"], cumAttr)] }]
-      if len(context["classroomDataRanked"]) > 0:
-        context["graphs"].append({ "name": "standings_chart",
-        "yAxisLabel": "classroom", "plotGoal": False,
-        "series": [(classroom.name, l, cumAttr)\
-        for classroom, _, l in context["classroomDataRanked"]] })
-        addStandingsStatement(context, cumAttr)
+      "attr": attr, "cumAttr": cumAttr,
+      "canSubmit": programCanBeUpdated(request.user, program) }
+    snapshot = snapshots.programPage(program, classrooms, category, cumAttr)
+    if snapshot != None:
+      context.update(snapshot)
+    else:
+      addProgramData(context, program, classrooms, cumAttr)
+      if context["hasData"]:
+        addProgramGraphs(context, cumAttr)
+        addCharts(context, "program " + category)
     return render(request, "wrpt/program-n.html", context)
 
+@caching.cachedPage(lambda id: id, userIndependent=True)
+def programStats (request, id):
+  # Returns the program's chart data as JSON (see chartData).
+  try:
+    program = Program.objects.select_related("school", "schedule").get(pk=id)
+  except Program.DoesNotExist:
+    raise Http404
+  classrooms = Classroom.objects.filter(program=program).order_by("name")
+  if len(classrooms) == 0: raise Http404
+  category, _, cumAttr = programCategory(request)
+  context = { "program": program, "category": category }
+  snapshot = snapshots.programPage(program, classrooms, category, cumAttr)
+  if snapshot != None:
+    context.update(snapshot)
+  else:
+    addProgramData(context, program, classrooms, cumAttr)
+    if context["hasData"]: addProgramGraphs(context, cumAttr)
+  return JsonResponse(chartData(context))
+
+def leaderboard (request):
+  # Ranks the classrooms of all current programs by cumulative
+  # participation in the category selected by the 'c' query parameter
+  # (see programCategory).  The sums are computed by the database; as
+  # in program standings, classrooms with zero participation are not
+  # ranked.  Tied classrooms share a rank.
+  category, _, cumAttr = programCategory(request)
+  today = datetime.date.today()
+  programIds = [p.pk for p in Program.objects.all() if p.isCurrent()]
+  sums = cumulativeSums(programIds, today)
+  l = []
+  for c in Classroom.objects.filter(program__in=programIds)\
+    .select_related("program", "program__school")\
+    .order_by("program__school__name", "name"):
+    if c.pk not in sums: continue
+    presentSum, activeSum, inactiveSum = sums[c.pk]
+    pct = { "combinedCumPct": percentage(activeSum+inactiveSum, presentSum),
+      "activeCumPct": percentage(activeSum, presentSum),
+      "inactiveCumPct": percentage(inactiveSum, presentSum) }[cumAttr]
+    if pct > 0: l.append((c, pct))
+  l.sort(key=lambda t: -t[1])
+  leaders = []
+  for i, (c, pct) in enumerate(l):
+    rank = leaders[-1][0] if i > 0 and pct == l[i-1][1] else i+1
+    leaders.append((rank, c, pct))
+  return render(request, "wrpt/leaderboard.html",
+    { "category": category, "leaders": leaders })
+
+countFields = ["enrollment", "value", "activeValue", "inactiveValue",
+  "absentees", "comments"]
+
+def enterCounts (request, id):
+  # Bulk entry of counts for all of a program's classrooms on one
+  # event date (selected by the 'd' query parameter, defaulting to
+  # the most recent event date not in the future).
+  try:
+    program = Program.objects.select_related("school", "schedule").get(pk=id)
+  except Program.DoesNotExist:
+    raise Http404
+  if not request.user.is_authenticated:
+    return redirect_to_login(request.get_full_path())
+  if not programCanBeUpdated(request.user, program): raise PermissionDenied
+  today = datetime.date.today()
+  dates = list(EventDate.objects.filter(schedule=program.schedule)\
+    .order_by("date"))
+  pastDates = [d for d in dates if d.date <= today]
+  date = None
+  if request.GET.get("d", "") != "":
+    date = ([d for d in dates if str(d.pk) == request.GET["d"]] or [None])[0]
+    if date == None: raise Http404
+  elif len(pastDates) > 0:
+    date = pastDates[-1]
+  context = { "program": program, "dates": pastDates, "date": date }
+  if date == None:
+    return render(request, "wrpt/enter_counts.html", context)
+  classrooms = list(Classroom.objects.filter(program=program).order_by("name"))
+  existing = {}
+  lastEnrollment = {}
+  for c in Count.objects.filter(program=program, eventDate__date__lte=date.date)\
+    .select_related("eventDate").order_by("eventDate__date"):
+    if c.eventDate_id == date.pk: existing[c.classroom_id] = c
+    lastEnrollment[c.classroom_id] = c.enrollment
+  rows = []
+  for cr in classrooms:
+    c = existing.get(cr.pk)
+    if c != None:
+      # In split programs the total value is derived, not entered.
+      initial = dict((f, getattr(c, f)) for f in countFields\
+        if not (f == "value" and program.splitCounts))
+    else:
+      initial = { "enrollment": lastEnrollment.get(cr.pk, cr.enrollment) }
+    rows.append((cr, CountRowForm(request.POST or None,
+      prefix="c%d" % cr.pk, initial=initial, program=program,
+      canSubmit=True)))
+  context["rows"] = rows
+  context["errors"] = []
+  if request.method == "POST":
+    if not program.isCurrent():
+      context["errors"].append("The program has concluded.")
+    if date.date > today:
+      context["errors"].append("Date is in the future.")
+    if all(f.is_valid() for _, f in rows) and len(context["errors"]) == 0:
+      created = []
+      updated = []
+      deleted = []
+      operations = []
+      for cr, f in rows:
+        if not f.has_changed(): continue
+        d = f.cleaned_data
+        c = existing.get(cr.pk)
+        if d["value"] != None:
+          if c != None:
+            before = audit.snapshot(c)
+            for a in countFields: setattr(c, a, d[a])
+            updated.append(c)
+            operations.append(("update", before, c))
+          else:
+            c = Count(program=program, eventDate=date, classroom=cr,
+              **dict((a, d[a]) for a in countFields))
+            created.append(c)
+        elif c != None:
+          deleted.append(c)
+          operations.append(("delete", c, None))
+      if len(created)+len(updated)+len(deleted) > 0:
+        try:
+          with transaction.atomic():
+            Count.objects.bulk_create(created)
+            Count.objects.bulk_update(updated, countFields)
+            Count.objects.filter(pk__in=[c.pk for c in deleted]).delete()
+            countsChanged(program.pk, [c.classroom_id for c in\
+              created+updated+deleted], date.date)
+        except IntegrityError:
+          # Someone else entered a count for one of the classrooms
+          # since the page was loaded.  Nothing has been saved; on
+          # resubmission the existing counts are reloaded and updated.
+          context["errors"].append("Counts were entered concurrently " +\
+            "by someone else; please review and resubmit.")
+          return render(request, "wrpt/enter_counts.html", context)
+        # IDs of created counts are not available on all databases.
+        operations += [("create", c, None) for c in created]
+        logBatch(request, operations)
+        messages.success(request, "%d count%s saved." % (len(operations),
+          "s" if len(operations) > 1 else ""))
+      else:
+        messages.success(request, "No changes.")
+      return HttpResponseRedirect("%s?d=%d" % (request.path, date.pk))
+  return render(request, "wrpt/enter_counts.html", context)
+
+dumpChunkSize = 2000 # rows
+
 @staff_member_required
 @gzip_page
 def dumpCounts (request):
-  s = io.StringIO()
-  w = csv.writer(s)
-  w.writerow(["program", "eventDate", "classroom", "enrollment", "value",
-    "activeValue", "inactiveValue", "absentees", "comments"])
-  for c in Count.objects.all().select_related("program", "program__school",
-    "eventDate", "classroom"):
-    w.writerow([c.program, c.eventDate.date, c.classroom.name,
-      c.enrollment, c.value, c.activeValue, c.inactiveValue,
-      c.absentees, c.comments])
-  return HttpResponse(s.getvalue(), content_type="text/plain; charset=UTF-8")
+  # The dump is streamed, and compressed as it goes by the gzip_page
+  # decorator, so that memory usage is independent of the number of
+  # counts.
+  form = DumpCountsForm(request.GET)
+  if not form.is_valid():
+    return HttpResponseBadRequest("Invalid filter: %s" %\
+      "; ".join("%s: %s" % (f, " ".join(e)) for f, e in form.errors.items()),
+      content_type="text/plain; charset=UTF-8")
+  counts = Count.objects.all()
+  f = form.cleaned_data
+  if f["program"] != None: counts = counts.filter(program=f["program"])
+  if f["schoolYear"] != "":
+    counts = counts.filter(program__schoolYear=f["schoolYear"])
+  if f["startDate"] != None:
+    counts = counts.filter(eventDate__date__gte=f["startDate"])
+  if f["endDate"] != None:
+    counts = counts.filter(eventDate__date__lte=f["endDate"])
+  counts = counts.select_related("program", "program__school", "eventDate",
+    "classroom")
+  def generate ():
+    s = io.StringIO()
+    w = csv.writer(s)
+    w.writerow(["program", "eventDate", "classroom", "enrollment", "value",
+      "activeValue", "inactiveValue", "absentees", "comments"])
+    for i, c in enumerate(counts.iterator(chunk_size=dumpChunkSize)):
+      w.writerow([c.program, c.eventDate.date, c.classroom.name,
+        c.enrollment, c.value, c.activeValue, c.inactiveValue,
+        c.absentees, c.comments])
+      if (i+1)%dumpChunkSize == 0:
+        yield s.getvalue()
+        s.seek(0)
+        s.truncate()
+    yield s.getvalue()
+  return StreamingHttpResponse(generate(),
+    content_type="text/plain; charset=UTF-8")
+
+@staff_member_required
+def importCounts (request):
+  # Imports counts from an uploaded CSV file (see wrpt.importer).
+  form = ImportCountsForm(request.POST or None, request.FILES or None)
+  context = { "form": form, "errors": [] }
+  if request.method == "POST" and form.is_valid():
+    checkOnly = form.cleaned_data["checkOnly"]
+    try:
+      errors, operations = importCountsFile(io.TextIOWrapper(
+        form.cleaned_data["file"], encoding="utf-8-sig", newline=""),
+        commit=not checkOnly)
+    except UnicodeDecodeError:
+      errors = ["File is not UTF-8 encoded text."]
+    except csv.Error as e:
+      errors = ["File is not valid CSV: %s." % e]
+    if len(errors) > 0:
+      context["errors"] = errors
+    elif checkOnly:
+      messages.success(request, "File is valid: %d count%s would be saved." %\
+        (len(operations), "s" if len(operations) != 1 else ""))
+    else:
+      if len(operations) > 0: logBatch(request, operations)
+      messages.success(request, "%d count%s saved." % (len(operations),
+        "s" if len(operations) != 1 else ""))
+      return HttpResponseRedirect(request.path)
+  return render(request, "wrpt/import_counts.html", context)
+
+@staff_member_required
+def importRoster (request):
+  # Imports a program's classrooms and event dates (see
+  # wrpt.importer).  Submitting the form displays the changes that
+  # would be made, with the pasted or uploaded texts carried in the
+  # form, so that the changes can then be confirmed.
+  form = ImportRosterForm(request.POST or None, request.FILES or None,
+    initial={ "program": request.GET.get("program") })
+  context = { "form": form, "errors": [], "changes": None }
+  if request.method == "POST" and form.is_valid():
+    d = form.cleaned_data
+    program = d["program"]
+    errors, changes = rosterChanges(program, d["roster"], d["dates"])
+    if len(errors) > 0:
+      context["errors"] = errors
+    elif "confirm" in request.POST:
+      importRosterChanges(program, changes)
+      messages.success(request, ("%s: %d classrooms created, %d updated; " +\
+        "%d event dates created.") % (program,
+        len(changes["createdClassrooms"]), len(changes["updatedClassrooms"]),
+        len(changes["createdDates"])))
+      return HttpResponseRedirect("%s?program=%d" % (request.path,
+        program.pk))
+    else:
+      # Uploaded texts replace the pasted ones in the redisplayed form.
+      data = request.POST.copy()
+      data["roster"], data["dates"] = d["roster"], d["dates"]
+      context["form"] = ImportRosterForm(data)
+      context["changes"] = changes
+      context["hasChanges"] = len(changes["createdClassrooms"]) +\
+        len(changes["updatedClassrooms"]) + len(changes["createdDates"]) > 0
+      context["otherPrograms"] = Program.objects\
+        .filter(schedule=program.schedule_id).exclude(pk=program.pk)\
+        .select_related("school")
+  return render(request, "wrpt/import_roster.html", context)
+
+maximumSearchResults = 100
+
+@staff_member_required
+def searchCounts (request):
+  # Finds counts by comment text (and program and classroom names)
+  # using the full-text index (see wrpt.search).
+  form = SearchForm(request.GET)
+  context = { "form": form, "counts": None }
+  if form.is_valid() and form.cleaned_data["q"].strip() != "":
+    context["counts"] = search.searchCounts(form.cleaned_data["q"],
+      maximumSearchResults)
+    context["truncated"] = (len(context["counts"]) == maximumSearchResults)
+  return render(request, "wrpt/search.html", context)
+
+@staff_member_required
+def metrics (request):
+  # Returns the performance metrics of all server processes (see
+  # wrpt.metrics) in Prometheus text format.
+  return HttpResponse(exposition(),
+    content_type="text/plain; version=0.0.4; charset=utf-8")